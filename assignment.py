@@ -0,0 +1,117 @@
+"""Распределение проверяющих с учетом их текущей загрузки.
+
+Новые работы раздаются так, чтобы у всех выровнялось отношение
+(непроверенные + новые) / вес, где вес - необязательная производительность
+проверяющего из config.yaml (assistant_weights, по умолчанию 1, 0 - не давать
+новых работ). Студент по возможности остается у проверяющего прошлого занятия,
+если тот не выходит за свою долю. Залежавшиеся работы можно передать
+наименее загруженным (/reassign).
+
+plan и quotas не зависят от бота, на них же работает симуляция
+benchmarks/assignment_sim.py.
+"""
+import heapq
+from collections import Counter
+
+from review import ReviewQueues
+from storage import Storage
+
+
+def quotas(count: int, backlog: Counter, weights: dict) -> Counter:
+    """Сколько из count новых работ дать каждому, чтобы выровнять (backlog + новые) / вес."""
+    heap = [((backlog[a] + 1) / w, a) for a, w in weights.items() if w > 0]
+    heapq.heapify(heap)
+    result = Counter()
+    if not heap:
+        return result
+    for _ in range(count):
+        _, a = heapq.heappop(heap)
+        result[a] += 1
+        heapq.heappush(heap, ((backlog[a] + result[a] + 1) / weights[a], a))
+    return result
+
+
+def plan(students: list, weights: dict, backlog: Counter, previous: dict = None) -> dict:
+    """Студент -> проверяющий для нового занятия.
+
+    previous - студент -> проверяющий прошлого занятия (для преемственности).
+    Если проверяющих нет, всем достается None.
+    """
+    previous = previous or {}
+    left = quotas(len(students), backlog, weights)
+    result = {}
+    rest = []
+    for student_id in students:
+        inspector = previous.get(student_id)
+        if left[inspector] > 0:
+            result[student_id] = inspector
+            left[inspector] -= 1
+        else:
+            rest.append(student_id)
+    free = left.elements()
+    for student_id in rest:
+        result[student_id] = next(free, None)
+    return result
+
+
+def least_loaded(weights: dict, backlog: Counter, exclude=None):
+    candidates = [(backlog[a] / w, a) for a, w in weights.items() if w > 0 and a != exclude]
+    return min(candidates)[1] if candidates else None
+
+
+class InspectorAssigner:
+    """Назначение проверяющих по данным хранилища и очередей проверки."""
+
+    def __init__(self, storage: Storage, reviews: ReviewQueues, weights: dict = None):
+        self.storage = storage
+        self.reviews = reviews
+        self._weights = weights or {}
+
+    def weights(self) -> dict:
+        return {a: float(self._weights.get(a, 1.0)) for a in self.storage.assistants()}
+
+    def assign_lesson(self, lesson: int, backlog: Counter) -> dict:
+        """Проверяющие для занятия lesson, которое сейчас будет добавлено.
+
+        Выполняется в пуле потоков, поэтому backlog (self.reviews.backlog())
+        снимается заранее в цикле событий, где меняются очереди.
+        """
+        student_ids = self.storage.student_ids()
+        previous = {}
+        if lesson > 1:
+            previous = {sid: sub['inspector'] for sid, sub in self.storage.lesson_submissions(lesson - 1)}
+        return plan(student_ids, self.weights(), backlog, previous)
+
+    def stale(self, submitted_at, max_age: float, now: float) -> list[tuple[int, int, str]]:
+        """Непроверенные работы старше max_age секунд, самые старые первыми.
+
+        submitted_at(id студента, дз) - время сдачи или None, если оно неизвестно.
+        """
+        found = []
+        for lesson, inspector, student_id in self.reviews.all_pending():
+            at = submitted_at(student_id, lesson)
+            if at is not None and now - at > max_age:
+                found.append((at, student_id, lesson, inspector))
+        found.sort()
+        return [(student_id, lesson, inspector) for _, student_id, lesson, inspector in found]
+
+    def plan_reassign(self, stale: list) -> list[tuple[int, int, str, str]]:
+        """Кому передать залежавшиеся работы: (студент, дз, старый, новый).
+
+        Работа уходит к наименее загруженному с учетом веса, если он загружен
+        меньше нынешнего проверяющего.
+        """
+        weights = self.weights()
+        backlog = self.reviews.backlog()
+        moves = []
+        for student_id, lesson, old in stale:
+            new = least_loaded(weights, backlog, exclude=old)
+            if new is None:
+                break
+            old_load = backlog[old] / weights[old] if weights.get(old) else float('inf')
+            if (backlog[new] + 1) / weights[new] >= old_load:
+                continue
+            backlog[old] -= 1
+            backlog[new] += 1
+            moves.append((student_id, lesson, old, new))
+        return moves
@@ -0,0 +1,147 @@
+"""Симуляция проверки дз: случайное назначение проверяющих против assignment.plan.
+
+Занятия идут каждые --lesson-every часов, после каждого студенты сдают работы
+(с вероятностью --submit-rate, через экспоненциальное время со средним
+--submit-mean часов). Проверяющие раз в сутки проверяют свою очередь по порядку
+сдачи, у каждого свой дневной предел (от --min-capacity до --max-capacity).
+Поток сдач и пределы одинаковы для всех схем, сравниваются:
+  random   - как раньше в add_day: random.choices с повторениями;
+  balanced - plan с учетом непроверенного, все веса 1;
+  weighted - plan с весами, равными дневному пределу;
+  +reassign - то же, плюс ежедневная передача работ старше --stale-after часов.
+Печатает распределение времени от сдачи до оценки (часы), долю проверенных
+за сутки и за двое, перекос нагрузки и долю студентов, оставшихся у прежнего проверяющего.
+
+    python benchmarks/assignment_sim.py --students 300 --assistants 6 --lessons 12
+"""
+import argparse
+import os
+import random
+import sys
+from collections import Counter, deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from assignment import least_loaded, plan
+
+DAY = 24.0
+
+
+def percentile(samples: list, p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+
+def make_world(args):
+    rng = random.Random(args.seed)
+    assistants = [f'@assistant{a}' for a in range(args.assistants)]
+    capacity = {a: rng.randint(args.min_capacity, args.max_capacity) for a in assistants}
+    # (время сдачи, дз, студент)
+    submissions = []
+    for lesson in range(1, args.lessons + 1):
+        start = (lesson - 1) * args.lesson_every
+        for student in range(args.students):
+            if rng.random() < args.submit_rate:
+                submissions.append((start + rng.expovariate(1 / args.submit_mean), lesson, student))
+    submissions.sort()
+    return assistants, capacity, submissions
+
+
+def simulate(args, scheme: str, assistants: list, capacity: dict, submissions: list) -> dict:
+    rng = random.Random(args.seed + 1)
+    weights = {a: float(capacity[a]) if scheme.startswith('weighted') else 1.0 for a in assistants}
+    reassign = scheme.endswith('+reassign')
+    queues = {a: deque() for a in assistants}   # (время сдачи, дз, студент)
+    inspector = {}                              # (дз, студент) -> проверяющий
+    previous = {}
+    waits = []
+    assigned_spread = []
+    kept = total = 0
+
+    lesson_times = [(lesson - 1) * args.lesson_every for lesson in range(1, args.lessons + 1)]
+    grading_times = [day * DAY + 20 for day in range(int(lesson_times[-1] // DAY) + args.tail_days)]
+    events = sorted(
+        [(t, 0, 'lesson', lesson) for lesson, t in enumerate(lesson_times, 1)] +
+        [(t, 1, 'submit', (lesson, student)) for t, lesson, student in submissions] +
+        [(t, 2, 'grade', None) for t in grading_times]
+    )
+    students = list(range(args.students))
+    for now, _, kind, payload in events:
+        if kind == 'lesson':
+            lesson = payload
+            if scheme == 'random':
+                chosen = dict(zip(students, rng.choices(assistants, k=len(students))))
+            else:
+                backlog = Counter({a: len(q) for a, q in queues.items()})
+                chosen = plan(students, weights, backlog, previous)
+            counts = Counter(chosen.values())
+            assigned_spread.append(max(counts.values()) / max(min(counts.values()), 1))
+            if lesson > 1:
+                kept += sum(chosen[s] == previous.get(s) for s in students)
+                total += len(students)
+            for student, a in chosen.items():
+                inspector[(lesson, student)] = a
+            previous = chosen
+        elif kind == 'submit':
+            lesson, student = payload
+            queues[inspector[(lesson, student)]].append((now, lesson, student))
+        else:
+            if reassign:
+                backlog = Counter({a: len(q) for a, q in queues.items()})
+                for old, queue in queues.items():
+                    while queue and now - queue[0][0] > args.stale_after:
+                        new = least_loaded(weights, backlog, exclude=old)
+                        if new is None or (backlog[new] + 1) / weights[new] >= backlog[old] / weights[old]:
+                            break
+                        queues[new].append(queue.popleft())
+                        backlog[old] -= 1
+                        backlog[new] += 1
+            for a, queue in queues.items():
+                for _ in range(min(capacity[a], len(queue))):
+                    submitted, _, _ = queue.popleft()
+                    waits.append(now - submitted)
+
+    left = sum(len(q) for q in queues.values())
+    return {
+        'graded': len(waits),
+        'ungraded': left,
+        'p50_h': percentile(waits, 50),
+        'p90_h': percentile(waits, 90),
+        'p99_h': percentile(waits, 99),
+        'max_h': max(waits, default=0.0),
+        'within_24h': sum(w <= 24 for w in waits) / max(len(waits), 1),
+        'within_48h': sum(w <= 48 for w in waits) / max(len(waits), 1),
+        'load_spread': sum(assigned_spread) / len(assigned_spread),
+        'continuity': kept / total if total else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--students', type=int, default=300)
+    parser.add_argument('--assistants', type=int, default=6)
+    parser.add_argument('--lessons', type=int, default=12)
+    parser.add_argument('--lesson-every', type=float, default=72.0, help='часов между занятиями')
+    parser.add_argument('--submit-rate', type=float, default=0.85)
+    parser.add_argument('--submit-mean', type=float, default=36.0, help='среднее время до сдачи, часов')
+    parser.add_argument('--min-capacity', type=int, default=10, help='работ в день у самого медленного')
+    parser.add_argument('--max-capacity', type=int, default=40, help='работ в день у самого быстрого')
+    parser.add_argument('--stale-after', type=float, default=48.0, help='часов до передачи работы другому')
+    parser.add_argument('--tail-days', type=int, default=14, help='сколько дней проверять после последнего занятия')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    world = make_world(args)
+    print('пределы проверяющих в день:', ', '.join(str(c) for c in world[1].values()))
+    columns = ['graded', 'ungraded', 'p50_h', 'p90_h', 'p99_h', 'max_h',
+               'within_24h', 'within_48h', 'load_spread', 'continuity']
+    print(f"{'scheme':<20}" + ''.join(f'{c:>12}' for c in columns))
+    for scheme in ('random', 'balanced', 'balanced+reassign', 'weighted', 'weighted+reassign'):
+        result = simulate(args, scheme, *world)
+        cells = ''.join(
+            f'{result[c]:>12}' if isinstance(result[c], int) else f'{result[c]:>12.2f}' for c in columns)
+        print(f'{scheme:<20}{cells}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+"""Локальная заглушка Bot API для нагрузочных тестов.
+
+Отвечает на запросы бота так, как ответил бы телеграм (getMe, getUpdates,
+sendMessage, sendDocument, sendMediaGroup, getFile, скачивание файлов),
+отдает обновления из очереди и считает, сколько и каких запросов пришло.
+Бот направляется на нее настройками base_url и base_file_url.
+
+С files_thread=True файлы отдаются отдельным http-сервером в своем потоке,
+чтобы их отправка не занимала цикл событий, в котором работает бот.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from email.parser import HeaderParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Illuminati', 'username': 'illuminati_test_bot',
+            'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+# rate_limits для config.yaml бота, при которых ограничения частоты не мешают замерам
+NO_LIMITS = {'overall_rate': 1e9, 'chat_rate': 1e9, 'chat_burst': 1e9, 'group_rate': 1e9}
+SEND_METHODS = {'sendmessage', 'senddocument', 'sendmediagroup', 'sendphoto', 'editmessagetext'}
+
+
+class ApiError(Exception):
+    """Запрос, на который телеграм ответил бы ошибкой 400."""
+
+
+def parse_params(content_type: str, body: bytes) -> dict:
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    if content_type.startswith('multipart/form-data'):
+        return parse_multipart(content_type, body)
+    return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+
+def parse_multipart(content_type: str, body: bytes) -> dict:
+    """Поля формы строками, приложенные файлы байтами.
+
+    Тело режется по границе вручную: email.parser портит двоичные файлы.
+    """
+    boundary = content_type.split('boundary=', 1)[1].strip('"').encode()
+    params = {}
+    for part in body.split(b'--' + boundary)[1:-1]:
+        head, _, data = part.partition(b'\r\n\r\n')
+        headers = HeaderParser().parsestr(head.decode().strip() + '\r\n\r\n')
+        name = headers.get_param('name', header='content-disposition')
+        data = data[:-2]  # \r\n перед следующей границей
+        # файл без attach:// приходит под именем поля media и не должен его затирать
+        params.setdefault(name, data if headers.get_filename() is not None else data.decode())
+    return params
+
+
+def user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+
+def message_update(update_id: int, user_id: int, text: str = None, document: dict = None,
+                   username: str = None, reply_to: int = None) -> dict:
+    """Обновление с сообщением от пользователя в личном чате с ботом."""
+    sender = user(user_id)
+    if username is not None:
+        sender['username'] = username
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private', 'username': sender['username'],
+                 'first_name': sender['first_name']},
+        'from': sender,
+    }
+    if text is not None:
+        message['text'] = text
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    if document is not None:
+        message['document'] = document
+    if reply_to is not None:
+        message['reply_to_message'] = {'message_id': reply_to, 'date': int(time.time()),
+                                       'chat': message['chat']}
+    return {'update_id': update_id, 'message': message}
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """Скачивание файлов с заглушки, запросы обслуживаются в потоках сервера."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        fake = self.server.fake
+        prefix = f'/file/bot{fake.token}/'
+        path = urlsplit(self.path).path
+        data = fake.files.get(path[len(prefix):]) if path.startswith(prefix) else None
+        self.send_response(200 if data is not None else 404)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data or b'')))
+        self.end_headers()
+        self.wfile.write(data or b'')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTelegram:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, token: str = '123:TEST',
+                 files_thread: bool = False):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.files_thread = files_thread
+        self.calls = Counter()
+        self.replies = 0
+        self.files = {}
+        self._unique_ids = {}
+        self._updates = []
+        self._new_updates = asyncio.Condition()
+        self._ids = itertools.count(1)
+        self._reply_waiters = []
+        self._server = None
+        self._connections = set()
+        self._file_server = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.host}:{self.port}/bot'
+
+    @property
+    def base_file_url(self) -> str:
+        if self._file_server is not None:
+            return f'http://{self.host}:{self._file_server.server_port}/file/bot'
+        return f'http://{self.host}:{self.port}/file/bot'
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.files_thread:
+            self._file_server = ThreadingHTTPServer((self.host, 0), FileHandler)
+            self._file_server.fake = self
+            threading.Thread(target=self._file_server.serve_forever, daemon=True).start()
+
+    async def stop(self):
+        if self._file_server is not None:
+            await asyncio.to_thread(self._file_server.shutdown)
+            self._file_server.server_close()
+        self._server.close()
+        for writer in list(self._connections):
+            writer.close()
+        await self._server.wait_closed()
+
+    def add_file(self, data: bytes) -> dict:
+        """Кладет файл на "сервер" и возвращает словарь Document для обновления."""
+        n = next(self._ids)
+        file_id = f'file{n}'
+        self.files[file_id] = data
+        self._unique_ids[file_id] = f'unique{n}'
+        return {'file_id': file_id, 'file_unique_id': f'unique{n}', 'file_name': f'hw{n}.pdf',
+                'file_size': len(data)}
+
+    async def push(self, update: dict):
+        async with self._new_updates:
+            self._updates.append(update)
+            self._new_updates.notify_all()
+
+    async def wait_replies(self, count: int):
+        """Ждет, пока бот в сумме отправит count сообщений."""
+        if self.replies >= count:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._reply_waiters.append((count, future))
+        await future
+
+    def _replied(self):
+        self.replies += 1
+        for waiter in list(self._reply_waiters):
+            count, future = waiter
+            if self.replies >= count and not future.done():
+                future.set_result(None)
+                self._reply_waiters.remove(waiter)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode().split(' ', 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if not line:
+                        break
+                    key, value = line.split(':', 1)
+                    headers[key.lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, content_type, payload = await self._dispatch(
+                    method, urlsplit(target).path, headers.get('content-type', ''), body)
+                writer.write(
+                    f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
+                    f'Content-Length: {len(payload)}\r\nConnection: keep-alive\r\n\r\n'.encode() + payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _dispatch(self, method: str, path: str, content_type: str, body: bytes):
+        file_prefix = f'/file/bot{self.token}/'
+        if path.startswith(file_prefix):
+            data = self.files.get(path[len(file_prefix):])
+            if data is None:
+                return '404 Not Found', 'text/plain', b''
+            return '200 OK', 'application/octet-stream', data
+        api_method = path.rsplit('/', 1)[-1]
+        self.calls[api_method] += 1
+        try:
+            result = await self._call(api_method.lower(), parse_params(content_type, body))
+        except ApiError as error:
+            return '400 Bad Request', 'application/json', json.dumps(
+                {'ok': False, 'error_code': 400, 'description': f'Bad Request: {error}'}).encode()
+        if api_method.lower() in SEND_METHODS:
+            self._replied()
+        return '200 OK', 'application/json', json.dumps({'ok': True, 'result': result}).encode()
+
+    def _message(self, params: dict, **extra) -> dict:
+        chat_id = int(params.get('chat_id', 0))
+        message = {'message_id': next(self._ids), 'date': int(time.time()),
+                   'chat': {'id': chat_id, 'type': 'private'}}
+        if 'text' in params:
+            message['text'] = params['text']
+        message.update(extra)
+        return message
+
+    def _sent_file(self, document, params: dict) -> dict:
+        """Document отправленного ботом файла; сам файл кладется на "сервер".
+
+        document - file_id, байты файла или attach://<поле формы с файлом>.
+        """
+        if document is None:
+            raise ApiError('there is no document in the request')
+        if isinstance(document, str) and document.startswith('attach://'):
+            document = params.get(document[len('attach://'):])
+            if not isinstance(document, bytes):
+                raise ApiError('file must be non-empty')
+        data = document if isinstance(document, bytes) else self.files.get(document, b'')
+        n = next(self._ids)
+        file_id = f'sent{n}'
+        self.files[file_id] = data
+        self._unique_ids[file_id] = f'sent_unique{n}'
+        return {'file_id': file_id, 'file_unique_id': f'sent_unique{n}', 'file_size': len(data)}
+
+    async def _call(self, method: str, params: dict):
+        if method == 'getme':
+            return BOT_USER
+        if method == 'getupdates':
+            offset = int(params.get('offset', 0) or 0)
+            timeout = float(params.get('timeout', 0) or 0)
+            async with self._new_updates:
+                self._updates = [u for u in self._updates if u['update_id'] >= offset]
+                if not self._updates and timeout:
+                    try:
+                        await asyncio.wait_for(self._new_updates.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                return self._updates[:int(params.get('limit', 100) or 100)]
+        if method == 'getfile':
+            file_id = params['file_id']
+            return {'file_id': file_id, 'file_unique_id': self._unique_ids.get(file_id, f'unique_{file_id}'),
+                    'file_size': len(self.files.get(file_id, b'')), 'file_path': file_id}
+        if method == 'senddocument':
+            return self._message(params, document=self._sent_file(params.get('document'), params))
+        if method == 'sendmediagroup':
+            media = params.get('media', [])
+            if isinstance(media, str):
+                media = json.loads(media)
+            return [self._message(params, document=self._sent_file(item.get('media'), params)) for item in media]
+        if method in SEND_METHODS:
+            return self._message(params)
+        return True
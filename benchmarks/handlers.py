@@ -0,0 +1,243 @@
+"""Бенчмарк обработчиков IlluminatiBot на синтетическом потоке обновлений.
+
+Строит списки на students студентов и lessons занятий (с уже сданными,
+но не проверенными работами), запускает настоящего бота с его
+ConversationHandler против заглушки Bot API и прогоняет сценарии:
+/start, сдачу дз (/hw, файл, комментарий), проверку (/check_hw, /next,
+оценки) и /add_day. Для каждого обработчика считает p50/p95/p99 времени
+его собственной работы (как гистограммы METRICS, но без округления до корзин),
+отдельно p50/p99 времени обновления целиком с ожиданием своей очереди,
+общую пропускную способность и пиковую память (tracemalloc).
+
+Работает без сети. Результат можно сохранить как baseline и сравнивать
+с ним следующие запуски:
+
+    python benchmarks/handlers.py --students 1000 --lessons 10 --save csv_1k
+    python benchmarks/handlers.py --students 1000 --lessons 10 --compare csv_1k
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+import yaml
+from telegram import Update
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_telegram import NO_LIMITS, FakeTelegram, message_update
+from illuminati import IlluminatiBot
+from metrics import METRICS
+from storage import ADMIN_COLUMNS, STUDENT_COLUMNS, SUBMISSION_FIELDS, atomic_write_csv, lesson_column
+
+BASELINES = os.path.join(BENCH_DIR, 'baselines')
+STUDENT_IDS = 100000
+ASSISTANT_IDS = 1000
+CURATOR_ID = 1
+
+
+def percentile(samples: list, p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+
+def build_course(workdir: str, fake: FakeTelegram, args) -> str:
+    """Синтетические students.csv/assistants.csv в прежнем широком формате и config.yaml."""
+    hwdir = os.path.join(workdir, 'homeworks')
+    os.makedirs(hwdir)
+    sample = os.path.join('homeworks', 'sample.pdf')
+    with open(os.path.join(workdir, sample), 'wb') as file:
+        file.write(os.urandom(args.file_size))
+
+    assistants = [f'@assistant{a}' for a in range(args.assistants)]
+    columns = list(STUDENT_COLUMNS)
+    for n in range(1, args.lessons + 1):
+        columns.append(lesson_column(n, f'{n:02d}-01-2026'))
+        columns.extend(lesson_column(n, field) for field in SUBMISSION_FIELDS)
+    students = []
+    for i in range(args.students):
+        record = {'Имя': f'Студент {i}', 'Ник': f'@student{i}'}
+        for n in range(1, args.lessons + 1):
+            record[lesson_column(n, 'inspector')] = assistants[i % len(assistants)]
+            # прошлые занятия сданы и ждут проверки, последнее еще сдают первые submitters студентов
+            if n < args.lessons or i >= args.submitters:
+                record[lesson_column(n, 'hw_path')] = sample
+        students.append(record)
+    atomic_write_csv(os.path.join(workdir, 'students.csv'), columns, students)
+    atomic_write_csv(os.path.join(workdir, 'assistants.csv'), ADMIN_COLUMNS,
+                     [{'Имя': 'Куратор', 'Ник': '@curator', 'Роль': 'Куратор'}] +
+                     [{'Имя': f'Ассистент {a}', 'Ник': nick, 'Роль': 'Ассистент'}
+                      for a, nick in enumerate(assistants)])
+
+    config = {
+        'token': fake.token,
+        'base_url': fake.base_url,
+        'base_file_url': fake.base_file_url,
+        'concurrent_updates': args.concurrent_updates,
+        'storage': args.storage,
+        'rate_limits': NO_LIMITS,
+    }
+    path = os.path.join(workdir, 'config.yaml')
+    with open(path, 'w') as file:
+        yaml.safe_dump(config, file)
+    return path
+
+
+def scripts(fake: FakeTelegram, args) -> list[list[tuple[str, dict]]]:
+    """Сценарии пользователей: список шагов (имя обработчика, обновление)."""
+    ids = itertools.count(1)
+    result = []
+    for i in range(min(args.submitters, args.students)):
+        user_id = STUDENT_IDS + i
+        username = f'student{i}'
+        document = fake.add_file(os.urandom(args.file_size))
+        result.append([
+            ('start', message_update(next(ids), user_id, '/start', username=username)),
+            ('hw_start', message_update(next(ids), user_id, f'/hw {args.lessons}', username=username)),
+            ('hw_file', message_update(next(ids), user_id, document=document, username=username)),
+            ('hw_question', message_update(next(ids), user_id, 'Вопрос по заданию', username=username)),
+        ])
+    for a in range(args.assistants):
+        user_id = ASSISTANT_IDS + a
+        username = f'assistant{a}'
+        steps = [
+            ('start', message_update(next(ids), user_id, '/start', username=username)),
+            ('ch_start', message_update(next(ids), user_id, '/check_hw 1', username=username)),
+            ('ch_next', message_update(next(ids), user_id, '/next', username=username)),
+        ]
+        steps += [('ch_stud', message_update(next(ids), user_id, str(k % 5 + 1), username=username))
+                  for k in range(args.grades)]
+        result.append(steps)
+    result.append([
+        ('start', message_update(next(ids), CURATOR_ID, '/start', username='curator')),
+        ('add_day', message_update(next(ids), CURATOR_ID, '/add_day', username='curator')),
+    ])
+    return result
+
+
+async def replay(bot: IlluminatiBot, script: list, waits: list):
+    """Шаги сценария по очереди; waits - время обновлений целиком, с ожиданием места и своей очереди."""
+    app = bot.application
+    for _, data in script:
+        update = Update.de_json(data, app.bot)
+        started = time.perf_counter()
+        await app.update_processor.process_update(update, app.process_update(update))
+        waits.append(time.perf_counter() - started)
+
+
+def record_handlers(latencies: dict):
+    """Время самих обработчиков: каждое наблюдение METRICS заодно пишется в latencies."""
+    observe = METRICS.observe_handler
+
+    def observe_and_record(name: str, seconds: float):
+        observe(name, seconds)
+        latencies[name].append(seconds)
+    METRICS.observe_handler = observe_and_record
+
+
+async def run(args) -> dict:
+    fake = FakeTelegram()
+    await fake.start()
+    workdir = tempfile.mkdtemp()
+    config_path = build_course(workdir, fake, args)
+    os.chdir(workdir)
+
+    tracemalloc.start()
+    load_started = time.perf_counter()
+    bot = IlluminatiBot(config_path)
+    load_seconds = time.perf_counter() - load_started
+    app = bot.application
+    latencies = defaultdict(list)
+    waits = []
+    record_handlers(latencies)
+    user_scripts = scripts(fake, args)
+
+    async with app:
+        await bot.post_init(app)
+        await app.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(replay(bot, script, waits) for script in user_scripts))
+        elapsed = time.perf_counter() - started
+        await app.stop()
+        await bot.post_stop(app)
+    await bot.post_shutdown(app)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await fake.stop()
+
+    updates = sum(len(script) for script in user_scripts)
+    return {
+        'params': {key: value for key, value in vars(args).items() if key not in ('save', 'compare')},
+        'startup_s': load_seconds,
+        'updates': updates,
+        'seconds': elapsed,
+        'updates_per_s': updates / elapsed,
+        'peak_memory_mb': peak / 2 ** 20,
+        'api_calls': dict(fake.calls),
+        'update_p50_ms': percentile(waits, 50) * 1000,
+        'update_p99_ms': percentile(waits, 99) * 1000,
+        'handlers': {
+            handler: {
+                'count': len(samples),
+                'p50_ms': percentile(samples, 50) * 1000,
+                'p95_ms': percentile(samples, 95) * 1000,
+                'p99_ms': percentile(samples, 99) * 1000,
+            }
+            for handler, samples in sorted(latencies.items())
+        },
+    }
+
+
+def report(result: dict, baseline: dict = None):
+    def delta(new, old):
+        return f' ({(new - old) / old * 100:+.0f}%)' if old else ''
+
+    base = baseline or {}
+    for key in ('startup_s', 'updates_per_s', 'peak_memory_mb', 'update_p50_ms', 'update_p99_ms'):
+        print(f'{key}: {result[key]:.2f}{delta(result[key], base.get(key, 0))}')
+    print(f"{'handler':<12}{'count':>7}{'p50 ms':>18}{'p95 ms':>18}{'p99 ms':>18}")
+    for handler, stats in result['handlers'].items():
+        old = base.get('handlers', {}).get(handler, {})
+        cells = ''.join(
+            f"{f'{stats[key]:.2f}{delta(stats[key], old.get(key, 0))}':>18}"
+            for key in ('p50_ms', 'p95_ms', 'p99_ms')
+        )
+        print(f"{handler:<12}{stats['count']:>7}{cells}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--students', type=int, default=1000)
+    parser.add_argument('--lessons', type=int, default=10)
+    parser.add_argument('--assistants', type=int, default=5)
+    parser.add_argument('--submitters', type=int, default=200, help='сколько студентов сдают дз в прогоне')
+    parser.add_argument('--grades', type=int, default=20, help='сколько оценок ставит каждый ассистент')
+    parser.add_argument('--file-size', type=int, default=64 * 1024)
+    parser.add_argument('--storage', choices=['csv', 'sqlite'], default='csv')
+    parser.add_argument('--concurrent-updates', type=int, default=16)
+    parser.add_argument('--save', metavar='NAME', help='сохранить результат как baselines/NAME.json')
+    parser.add_argument('--compare', metavar='NAME', help='сравнить с baselines/NAME.json')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(os.path.join(BASELINES, args.compare + '.json')) as file:
+            baseline = json.load(file)
+    result = asyncio.run(run(args))
+    report(result, baseline)
+    if args.save:
+        os.makedirs(BASELINES, exist_ok=True)
+        with open(os.path.join(BASELINES, args.save + '.json'), 'w') as file:
+            json.dump(result, file, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Нагрузочный тест: сколько обновлений в секунду бот обрабатывает в режимах polling и webhook.
+
+Поднимает заглушку Bot API (fake_telegram.py), запускает настоящий IlluminatiBot
+во временной папке с синтетическими списками и засыпает его командами
+/start, /help и /contacts от множества пользователей.
+
+    python benchmarks/load_updates.py --mode polling --users 500 --concurrent-updates 16
+    python benchmarks/load_updates.py --mode webhook --users 500 --concurrent-updates 1
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import NO_LIMITS, FakeTelegram, message_update
+from illuminati import IlluminatiBot
+from storage import ADMIN_COLUMNS, STUDENT_COLUMNS, atomic_write_csv
+
+COMMANDS = ['/start', '/help', '/contacts']
+WEBHOOK_PORT = 8787
+SECRET = 'load-test'
+
+
+def write_course(workdir: str, fake: FakeTelegram, args) -> str:
+    atomic_write_csv(os.path.join(workdir, 'students.csv'), STUDENT_COLUMNS,
+                     [{'Имя': f'Студент {i}', 'Ник': f'@user{i}'} for i in range(1, args.users + 1)])
+    atomic_write_csv(os.path.join(workdir, 'assistants.csv'), ADMIN_COLUMNS,
+                     [{'Имя': 'Куратор', 'Ник': '@curator', 'Роль': 'Куратор'},
+                      {'Имя': 'Ассистент', 'Ник': '@assistant', 'Роль': 'Ассистент'}])
+    config = {
+        'token': fake.token,
+        'base_url': fake.base_url,
+        'base_file_url': fake.base_file_url,
+        'concurrent_updates': args.concurrent_updates,
+        'mode': args.mode,
+        'webhook': {'listen': '127.0.0.1', 'port': WEBHOOK_PORT, 'url_path': 'hook', 'secret_token': SECRET},
+    }
+    if not args.respect_limits:
+        config['rate_limits'] = NO_LIMITS
+    path = os.path.join(workdir, 'config.yaml')
+    with open(path, 'w') as file:
+        yaml.safe_dump(config, file)
+    return path
+
+
+async def deliver(fake: FakeTelegram, mode: str, updates: list):
+    if mode == 'polling':
+        for update in updates:
+            await fake.push(update)
+        return
+    url = f'http://127.0.0.1:{WEBHOOK_PORT}/hook'
+    headers = {'X-Telegram-Bot-Api-Secret-Token': SECRET}
+    limits = httpx.Limits(max_connections=64)
+    async with httpx.AsyncClient(limits=limits) as client:
+        semaphore = asyncio.Semaphore(64)
+
+        async def post(update):
+            async with semaphore:
+                await client.post(url, json=update, headers=headers)
+
+        await asyncio.gather(*(post(update) for update in updates))
+
+
+async def run(args) -> dict:
+    fake = FakeTelegram()
+    await fake.start()
+    workdir = tempfile.mkdtemp()
+    config_path = write_course(workdir, fake, args)
+    os.chdir(workdir)
+    bot = IlluminatiBot(config_path)
+    app = bot.application
+
+    ids = itertools.count(1)
+    updates = [
+        message_update(next(ids), user_id, COMMANDS[(user_id + k) % len(COMMANDS)])
+        for k in range(args.updates_per_user)
+        for user_id in range(1, args.users + 1)
+    ]
+
+    async with app:
+        await bot.post_init(app)
+        await app.start()
+        if args.mode == 'polling':
+            await app.updater.start_polling(poll_interval=0, timeout=1)
+        else:
+            await app.updater.start_webhook(listen='127.0.0.1', port=WEBHOOK_PORT,
+                                            url_path='hook', secret_token=SECRET)
+        started = time.perf_counter()
+        await deliver(fake, args.mode, updates)
+        await fake.wait_replies(len(updates))
+        elapsed = time.perf_counter() - started
+        await app.updater.stop()
+        await app.stop()
+        await bot.post_stop(app)
+    lag = bot.loop_lag.summary()
+    await bot.post_shutdown(app)
+    await fake.stop()
+    return {
+        'mode': args.mode,
+        'concurrent_updates': args.concurrent_updates,
+        'updates': len(updates),
+        'seconds': elapsed,
+        'updates_per_s': len(updates) / elapsed,
+        'loop_lag_p99_ms': lag['p99'] * 1000,
+        'api_calls': dict(fake.calls),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default='polling')
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--updates-per-user', type=int, default=3)
+    parser.add_argument('--concurrent-updates', type=int, default=16)
+    parser.add_argument('--respect-limits', action='store_true',
+                        help='не отключать ограничения частоты отправки сообщений')
+    result = asyncio.run(run(parser.parse_args()))
+    for key, value in result.items():
+        print(f'{key}: {value:.2f}' if isinstance(value, float) else f'{key}: {value}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Задержка /help и цикла событий, пока бот принимает большие файлы.
+
+Запускает настоящего IlluminatiBot против заглушки Bot API (как
+benchmarks/handlers.py). Каждые 10 мс кто-то из HELPERS студентов присылает
+/help, не дожидаясь ответа на прошлые, и для каждого считается время от прихода
+обновления до конца обработки. Сначала /help идет на свободного бота, потом
+одновременно с --uploads сдачами дз по --size-mb МБ: файлы скачиваются
+Downloader'ом с заглушки и сохраняются в хранилище дз, как при настоящей сдаче.
+Заглушка отдает файлы из отдельного потока, так что разница фаз - то, во что
+загрузки обходятся остальным пользователям в цикле событий самого бота.
+
+    python benchmarks/loop_lag.py --uploads 8 --size-mb 20
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from telegram import Update
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from blocking import LoopLagMonitor
+from fake_telegram import FakeTelegram, message_update
+from handlers import STUDENT_IDS, build_course, percentile
+from illuminati import IlluminatiBot
+
+# студенты, которые по кругу шлют /help, следом за сдающими дз
+HELPERS = 50
+
+
+async def handle(app, data: dict):
+    update = Update.de_json(data, app.bot)
+    await app.update_processor.process_update(update, app.process_update(update))
+
+
+async def help_request(app, data: dict, latencies: list):
+    arrival = time.perf_counter()
+    await handle(app, data)
+    latencies.append(time.perf_counter() - arrival)
+
+
+async def help_requests(app, ids, first: int, latencies: list, stop: asyncio.Event):
+    """/help приходит раз в 10 мс независимо от того, ответил ли бот на прошлые."""
+    requests = []
+    arrival = time.perf_counter()
+    for k in itertools.count():
+        if stop.is_set():
+            break
+        arrival += 0.01
+        await asyncio.sleep(max(arrival - time.perf_counter(), 0))
+        student = first + k % HELPERS
+        data = message_update(next(ids), STUDENT_IDS + student, '/help', username=f'student{student}')
+        requests.append(asyncio.create_task(help_request(app, data, latencies)))
+    await asyncio.gather(*requests)
+
+
+async def upload(app, ids, student: int, document: dict):
+    user_id = STUDENT_IDS + student
+    username = f'student{student}'
+    for data in (message_update(next(ids), user_id, '/start', username=username),
+                 message_update(next(ids), user_id, '/hw 1', username=username),
+                 message_update(next(ids), user_id, document=document, username=username)):
+        await handle(app, data)
+
+
+async def phase(app, ids, first_helper: int, work) -> dict:
+    monitor = LoopLagMonitor(interval=0.01, warn_after=float('inf'))
+    lag_task = asyncio.create_task(monitor.run())
+    latencies = []
+    stop = asyncio.Event()
+    help_task = asyncio.create_task(help_requests(app, ids, first_helper, latencies, stop))
+    started = time.perf_counter()
+    await work()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await help_task
+    lag_task.cancel()
+    return {
+        'seconds': elapsed,
+        'help_p50_ms': percentile(latencies, 50) * 1000,
+        'help_p99_ms': percentile(latencies, 99) * 1000,
+        'lag_p99_ms': monitor.percentile(99) * 1000,
+        'lag_max_ms': monitor.max_lag * 1000,
+    }
+
+
+async def run(args) -> dict:
+    fake = FakeTelegram(files_thread=True)
+    await fake.start()
+    workdir = tempfile.mkdtemp()
+    params = SimpleNamespace(students=args.uploads + HELPERS, submitters=args.uploads, lessons=1, assistants=2,
+                             file_size=1024, storage=args.storage, concurrent_updates=args.concurrent_updates)
+    config_path = build_course(workdir, fake, params)
+    os.chdir(workdir)
+    bot = IlluminatiBot(config_path)
+    app = bot.application
+    ids = itertools.count(1)
+    results = {}
+    async with app:
+        await bot.post_init(app)
+        await app.start()
+        # файлы готовятся заранее, чтобы os.urandom не попал в замер
+        documents = [fake.add_file(os.urandom(args.size_mb << 20)) for _ in range(args.uploads)]
+        results['idle'] = await phase(app, ids, args.uploads, lambda: asyncio.sleep(args.idle_seconds))
+        results['uploads'] = await phase(app, ids, args.uploads, lambda: asyncio.gather(
+            *(upload(app, ids, student, document) for student, document in enumerate(documents))))
+        await app.stop()
+        await bot.post_stop(app)
+    await bot.post_shutdown(app)
+    await fake.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--uploads', type=int, default=8)
+    parser.add_argument('--size-mb', type=int, default=20)
+    parser.add_argument('--idle-seconds', type=float, default=2.0)
+    parser.add_argument('--storage', choices=['csv', 'sqlite'], default='csv')
+    parser.add_argument('--concurrent-updates', type=int, default=16)
+    args = parser.parse_args()
+
+    for name, result in asyncio.run(run(args)).items():
+        print(f'{name:<8}' + ' '.join(f'{k}={v:.2f}' for k, v in result.items()))
+
+
+if __name__ == '__main__':
+    main()
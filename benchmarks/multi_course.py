@@ -0,0 +1,92 @@
+"""Память и время старта: много курсов в одном процессе против процесса на курс.
+
+Строит --courses синтетических курсов (как benchmarks/handlers.py) в папках
+courses/<n> и один config.yaml с разделом courses. Затем запускает отдельный
+процесс, который создает бота с одним курсом, и отдельный процесс со всеми
+курсами сразу. Печатает время инициализации и пиковую память (maxrss) обоих,
+а также сколько памяти заняли бы --courses отдельных процессов.
+
+    python benchmarks/multi_course.py --courses 50 --students 30 --lessons 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import yaml
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from handlers import build_course
+
+CHILD = """
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+from illuminati import IlluminatiBot
+started = time.perf_counter()
+bot = IlluminatiBot({config!r})
+ready = time.perf_counter()
+for course in bot.courses.values():
+    course.store.close()
+bot.blocking.shutdown()
+print(json.dumps({{'courses': len(bot.courses), 'init_s': ready - started,
+                  'maxrss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+
+
+def start_once(workdir: str, config: str) -> dict:
+    output = subprocess.run([sys.executable, '-c', CHILD.format(root=ROOT, config=config)], cwd=workdir,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--courses', type=int, default=50)
+    parser.add_argument('--students', type=int, default=30)
+    parser.add_argument('--lessons', type=int, default=10)
+    parser.add_argument('--assistants', type=int, default=2)
+    parser.add_argument('--file-size', type=int, default=1024)
+    parser.add_argument('--storage', choices=['csv', 'sqlite'], default='csv')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    fake = SimpleNamespace(token='123:TEST', base_url='http://127.0.0.1:9/bot',
+                           base_file_url='http://127.0.0.1:9/file/bot')
+    params = SimpleNamespace(students=args.students, submitters=args.students, lessons=args.lessons,
+                             assistants=args.assistants, file_size=args.file_size, storage=args.storage,
+                             concurrent_updates=16)
+    courses = {}
+    for n in range(args.courses):
+        directory = os.path.join(workdir, 'courses', str(n))
+        os.makedirs(directory)
+        config_path = build_course(directory, fake, params)
+        courses[f'course{n}'] = os.path.join('courses', str(n))
+    with open(config_path) as file:
+        config = yaml.safe_load(file)
+    single = os.path.join(workdir, 'single.yaml')
+    with open(single, 'w') as file:
+        yaml.safe_dump({**config, 'courses': {'course0': courses['course0']}}, file)
+    shared = os.path.join(workdir, 'config.yaml')
+    with open(shared, 'w') as file:
+        yaml.safe_dump({**config, 'courses': courses}, file)
+
+    # первый запуск переносит csv в sqlite или пишет снимки
+    start_once(workdir, shared)
+    one = start_once(workdir, single)
+    many = start_once(workdir, shared)
+    print(f"{'case':<24}{'courses':>8}{'init s':>10}{'maxrss MB':>12}")
+    print(f"{'one course':<24}{one['courses']:>8}{one['init_s']:>10.3f}{one['maxrss_mb']:>12.1f}")
+    print(f"{'all in one process':<24}{many['courses']:>8}{many['init_s']:>10.3f}{many['maxrss_mb']:>12.1f}")
+    print(f"{'process per course':<24}{args.courses:>8}{one['init_s'] * args.courses:>10.3f}"
+          f"{one['maxrss_mb'] * args.courses:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
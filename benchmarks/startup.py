@@ -0,0 +1,108 @@
+"""Время холодного старта бота: импорты и IlluminatiBot.__init__ в новом процессе.
+
+Строит синтетический курс (как benchmarks/handlers.py) и несколько раз запускает
+отдельный процесс, который импортирует illuminati и создает бота. Сравниваются:
+  csv-no-snapshot - csv читаются каждый раз (snapshot: false);
+  csv-snapshot    - первый старт пишет снимок, следующие читают его;
+  sqlite          - база sqlite.
+Для каждого случая печатает медиану импорта, инициализации и суммы, а также
+импортировался ли pandas.
+
+    python benchmarks/startup.py --students 5000 --lessons 20 --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import yaml
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from handlers import build_course
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {root!r})
+from illuminati import IlluminatiBot
+imported = time.perf_counter()
+bot = IlluminatiBot('config.yaml')
+ready = time.perf_counter()
+for course in bot.courses.values():
+    course.store.close()
+bot.blocking.shutdown()
+print(json.dumps({{'import_s': imported - started, 'init_s': ready - imported,
+                  'pandas': 'pandas' in sys.modules}}))
+"""
+
+
+def start_once(workdir: str) -> dict:
+    output = subprocess.run([sys.executable, '-c', CHILD.format(root=ROOT)], cwd=workdir,
+                            check=True, capture_output=True, text=True).stdout
+    sample = json.loads(output.strip().splitlines()[-1])
+    sample['total_s'] = sample['import_s'] + sample['init_s']
+    return sample
+
+
+def measure(workdir: str, runs: int) -> dict:
+    samples = [start_once(workdir) for _ in range(runs)]
+    return {
+        'import_s': statistics.median(s['import_s'] for s in samples),
+        'init_s': statistics.median(s['init_s'] for s in samples),
+        'total_s': statistics.median(s['total_s'] for s in samples),
+        'pandas': any(s['pandas'] for s in samples),
+    }
+
+
+def course(args, storage: str, snapshot: bool) -> str:
+    workdir = tempfile.mkdtemp()
+    fake = SimpleNamespace(token='123:TEST', base_url='http://127.0.0.1:9/bot',
+                           base_file_url='http://127.0.0.1:9/file/bot')
+    params = SimpleNamespace(**vars(args), submitters=args.students, storage=storage, concurrent_updates=16)
+    config_path = build_course(workdir, fake, params)
+    if not snapshot:
+        with open(config_path) as file:
+            config = yaml.safe_load(file)
+        config['snapshot'] = False
+        with open(config_path, 'w') as file:
+            yaml.safe_dump(config, file)
+    return workdir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--lessons', type=int, default=20)
+    parser.add_argument('--assistants', type=int, default=10)
+    parser.add_argument('--file-size', type=int, default=1024)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    runs = args.runs
+    del args.runs
+
+    results = {}
+    workdir = course(args, 'csv', snapshot=False)
+    results['csv-no-snapshot'] = measure(workdir, runs)
+    workdir = course(args, 'csv', snapshot=True)
+    # первый старт читает csv и пишет снимок
+    results['csv-first-start'] = start_once(workdir)
+    results['csv-snapshot'] = measure(workdir, runs)
+    workdir = course(args, 'sqlite', snapshot=True)
+    start_once(workdir)  # перенос csv в базу при первом старте
+    results['sqlite'] = measure(workdir, runs)
+
+    print(f"{'case':<18}{'import s':>10}{'init s':>10}{'total s':>10}{'pandas':>8}")
+    for case, r in results.items():
+        print(f"{case:<18}{r['import_s']:>10.3f}{r['init_s']:>10.3f}{r['total_s']:>10.3f}{str(r['pandas']):>8}")
+
+
+if __name__ == '__main__':
+    main()
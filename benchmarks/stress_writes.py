@@ -0,0 +1,224 @@
+"""Стресс-проверка записи: сотни одновременных сдач, комментариев, оценок и передач работ.
+
+Вперемешку запускает те же методы курса, что вызывают обработчики hw_file,
+hw_question, ch_stud и /reassign (Course.submit, comment, grade, move), с записью
+через пул потоков и паузой на месте скачивания файла. Параллельно хранилище
+сбрасывается на диск. В конце оно перечитывается с диска и проверяется, что ни
+одно изменение не потерялось, а очереди проверки в памяти совпадают с
+очередями, заново построенными по таблице.
+
+С --no-locks замки сдач выключены, а оценка и передача одной работы
+выстраиваются в тот порядок, от которого замки защищают: передача записана в
+хранилище, оценка проходит целиком, и только потом передача поправляет очереди.
+Проверенная работа остается в очереди нового проверяющего; скрипт завершается
+с ошибкой, если расхождений при этом не нашлось.
+
+    python benchmarks/stress_writes.py --storage sqlite --students 300 --lessons 3
+    python benchmarks/stress_writes.py --no-locks
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+from contextlib import asynccontextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blocking import BlockingExecutor
+from course import Course
+from review import ReviewQueues
+from storage import STUDENT_COLUMNS, ADMIN_COLUMNS, atomic_write_csv, open_storage
+
+INSPECTORS = ('@assistant0', '@assistant1')
+
+
+class NoLock:
+    """KeyedLock, который ничего не запирает."""
+
+    @asynccontextmanager
+    async def __call__(self, key):
+        yield
+
+    def __len__(self):
+        return 0
+
+
+class Interleaving:
+    """Пул потоков для --no-locks, который ставит оценку между записью передачи
+    работы в хранилище и правкой очередей (без замков это может случиться и так,
+    но лишь изредка)."""
+
+    def __init__(self, blocking: BlockingExecutor, keys):
+        self._blocking = blocking
+        self._moved = {key: asyncio.Event() for key in keys}
+        self._graded = {key: asyncio.Event() for key in keys}
+
+    def __getattr__(self, name):
+        return getattr(self._blocking, name)
+
+    async def run(self, func, *args, **kwargs):
+        name, key = getattr(func, '__name__', None), tuple(args[:2])
+        if key not in self._moved:
+            return await self._blocking.run(func, *args, **kwargs)
+        if name == 'update_submission' and 'mark' in kwargs:
+            await self._moved[key].wait()
+        result = await self._blocking.run(func, *args, **kwargs)
+        if name == 'update_submission' and 'inspector' in kwargs:
+            self._moved[key].set()
+            await self._graded[key].wait()
+        elif name == 'submission' and self._moved[key].is_set():
+            # это чтение из Course.grade: очереди он поправит сразу после него,
+            # до того как проснется передача
+            self._graded[key].set()
+        return result
+
+
+def make_course(kind: str, workdir: str, students: int, blocking: BlockingExecutor) -> Course:
+    atomic_write_csv(os.path.join(workdir, 'students.csv'), STUDENT_COLUMNS,
+                     [{'Имя': f'Студент {i}', 'Ник': f'@student{i}'} for i in range(students)])
+    atomic_write_csv(os.path.join(workdir, 'assistants.csv'), ADMIN_COLUMNS,
+                     [{'Имя': nick, 'Ник': nick, 'Роль': 'Ассистент'} for nick in INSPECTORS])
+    # sqlite переносит students.csv в базу при первом открытии
+    config = {'storage': kind, 'database': os.path.join(workdir, 'course.db'),
+              'flush_interval': 0.01, 'snapshot': False}
+    return Course('stress', workdir, config, blocking)
+
+
+async def pause():
+    await asyncio.sleep(random.random() / 1000)
+
+
+async def submit(course: Course, student_id: int, lesson: int):
+    async def save():
+        await pause()  # скачивание файла
+        return f'hw/{student_id}_{lesson}'
+    await course.submit(student_id, lesson, save, f'file {student_id} {lesson}')
+    await pause()
+    await course.comment(student_id, lesson, f'comment {student_id} {lesson}')
+
+
+async def grade(course: Course, student_id: int, lesson: int):
+    await course.grade(student_id, lesson, str((student_id + lesson) % 5 + 1))
+
+
+async def move(course: Course, student_id: int, lesson: int):
+    await course.move(student_id, lesson, INSPECTORS[0], INSPECTORS[1])
+
+
+async def lifecycle(course: Course, student_id: int, lesson: int, during_move: bool):
+    """Сдача, комментарий и оценка одной работы; оценка может прийти, пока
+    /reassign передает эту работу другому проверяющему."""
+    await pause()
+    await submit(course, student_id, lesson)
+    await pause()
+    if during_move:
+        await asyncio.gather(grade(course, student_id, lesson), move(course, student_id, lesson))
+    else:
+        await grade(course, student_id, lesson)
+
+
+async def flusher(course: Course, done: asyncio.Event):
+    while not done.is_set():
+        await course.blocking.run(course.store.flush)
+        await asyncio.sleep(0.005)
+
+
+async def stress(course: Course, students: int, lessons: int, interleave: bool) -> tuple[int, set]:
+    moved = set()
+    for _ in range(lessons):
+        inspectors = {i: INSPECTORS[0] for i in range(students)}
+        n = course.store.add_lesson('01-01-2026', inspectors)
+        for student_id, inspector in inspectors.items():
+            course.reviews.assign(student_id, n, inspector)
+    jobs = []
+    for student_id in range(students):
+        for lesson in range(1, lessons + 1):
+            during_move = random.random() < 0.5
+            if during_move:
+                moved.add((student_id, lesson))
+            jobs.append(lifecycle(course, student_id, lesson, during_move))
+    random.shuffle(jobs)
+    if interleave:
+        course.blocking = Interleaving(course.blocking, moved)
+    done = asyncio.Event()
+    flush_task = asyncio.create_task(flusher(course, done))
+    await asyncio.gather(*jobs)
+    done.set()
+    await flush_task
+    return len(jobs), moved
+
+
+def check_storage(storage, students: int, lessons: int, moved: set) -> list[str]:
+    errors = []
+    for student_id in range(students):
+        for lesson in range(1, lessons + 1):
+            expected = {
+                'hw_path': f'hw/{student_id}_{lesson}',
+                'inspector': INSPECTORS[(student_id, lesson) in moved],
+                'comment': f'comment {student_id} {lesson}',
+                'mark': str((student_id + lesson) % 5 + 1),
+            }
+            actual = storage.submission(student_id, lesson)
+            if actual != expected:
+                errors.append(f'{student_id}/{lesson}: {actual} != {expected}')
+            if storage.file_id(student_id, lesson) != f'file {student_id} {lesson}':
+                errors.append(f'{student_id}/{lesson}: file_id {storage.file_id(student_id, lesson)}')
+    return errors
+
+
+def check_queues(live: ReviewQueues, storage, lessons: int) -> list[str]:
+    """Очереди, которые поправлялись по ходу, против построенных заново по таблице."""
+    fresh = ReviewQueues(storage)
+    errors = []
+    for lesson in range(1, lessons + 1):
+        for inspector in INSPECTORS:
+            got, want = set(live.pending(lesson, inspector)), set(fresh.pending(lesson, inspector))
+            for student_id in sorted(got ^ want):
+                errors.append(f'{student_id}/{lesson}: in queue of {inspector} {student_id in got}, '
+                              f'by table {student_id in want}')
+            for name in ('assigned_count', 'not_submitted_count'):
+                got, want = getattr(live, name)(lesson, inspector), getattr(fresh, name)(lesson, inspector)
+                if got != want:
+                    errors.append(f'{lesson}/{inspector} {name}: {got} != {want}')
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--storage', choices=['csv', 'sqlite'], default='sqlite')
+    parser.add_argument('--students', type=int, default=300)
+    parser.add_argument('--lessons', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-locks', action='store_true', help='выключить замки сдач')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    blocking = BlockingExecutor(4)
+    with tempfile.TemporaryDirectory() as workdir:
+        course = make_course(args.storage, workdir, args.students, blocking)
+        if args.no_locks:
+            course.submission_locks = NoLock()
+        jobs, moved = asyncio.run(stress(course, args.students, args.lessons, args.no_locks))
+        course.store.close()
+        reloaded = open_storage(course.config, course.students, course.admins)
+        errors = check_storage(reloaded, args.students, args.lessons, moved)
+        errors += check_queues(course.reviews, reloaded, args.lessons)
+        reloaded.close()
+    blocking.shutdown()
+    leaked = len(course.submission_locks)
+
+    print(f'{jobs} coroutines, {len(errors)} lost or inconsistent updates, {leaked} leaked locks')
+    for error in errors[:10]:
+        print(error)
+    if args.no_locks:
+        # без замков расхождения обязаны найтись, иначе проверка ничего не ловит
+        if not errors:
+            print('--no-locks: expected inconsistent updates, found none')
+        sys.exit(0 if errors else 1)
+    sys.exit(1 if errors or leaked else 0)
+
+
+if __name__ == '__main__':
+    main()
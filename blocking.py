@@ -0,0 +1,138 @@
+"""Вынос блокирующей работы (диск, pandas, sqlite) из цикла событий.
+
+Весь бот работает в одном цикле asyncio, поэтому любое чтение или запись
+файла прямо в обработчике заставляет ждать всех остальных пользователей.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class BlockingExecutor:
+    """Ограниченный пул потоков для работы с хранилищем и файлами."""
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='illuminati-io')
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, partial(func, *args, **kwargs))
+
+    async def makedirs(self, path: str):
+        await self.run(os.makedirs, path, exist_ok=True)
+
+    async def read_bytes(self, path: str) -> bytes:
+        def read():
+            with open(path, 'rb') as file:
+                return file.read()
+        return await self.run(read)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(partial(file.read, chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Downloader:
+    """Потоковое скачивание файлов из телеграма кусками.
+
+    Куски пишутся во временный файл через пул потоков, а готовый файл
+    атомарно переименовывается, так что большой файл не держит цикл событий
+    и недокачанный файл никогда не оказывается на месте настоящего.
+    """
+
+    def __init__(self, executor: BlockingExecutor, chunk_size: int = 1 << 20):
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self._client = None
+
+    async def download(self, file, path: str) -> str:
+        """Скачивает telegram.File в path, возвращает sha256 содержимого."""
+        if '://' not in file.file_path:
+            # бот работает с локальным Bot API сервером, файл уже на диске
+            await file.download_to_drive(path)
+            return await self.executor.run(file_sha256, path)
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=120.0))
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = await self.executor.run(
+            tempfile.mkstemp, dir=directory, prefix='.' + os.path.basename(path), suffix='.part')
+        out = os.fdopen(fd, 'wb')
+        digest = hashlib.sha256()
+
+        def write(chunk: bytes):
+            out.write(chunk)
+            digest.update(chunk)
+
+        try:
+            async with self._client.stream('GET', file.file_path) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(self.chunk_size):
+                    await self.executor.run(write, chunk)
+            await self.executor.run(out.close)
+            await self.executor.run(os.replace, tmp_path, path)
+            return digest.hexdigest()
+        except BaseException:
+            out.close()
+            os.unlink(tmp_path)
+            raise
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class LoopLagMonitor:
+    """Измеряет, насколько цикл событий опаздывает просыпаться.
+
+    Каждые interval секунд засыпает и смотрит, на сколько позже запланированного
+    проснулся. Если что-то блокирует цикл, задержка растет у всех обработчиков сразу.
+    """
+
+    def __init__(self, interval: float = 0.1, window: int = 3000, warn_after: float = 0.5):
+        self.interval = interval
+        self.warn_after = warn_after
+        self.samples = deque(maxlen=window)
+        self.max_lag = 0.0
+
+    async def run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - started - self.interval, 0.0)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.warn_after:
+                logger.warning('Event loop was blocked for %.3f s', lag)
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)]
+
+    def summary(self) -> dict:
+        return {
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max_lag,
+            'samples': len(self.samples),
+        }
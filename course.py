@@ -0,0 +1,199 @@
+"""Курсы, которые обслуживает один процесс бота.
+
+У каждого курса своя папка со students.csv, assistants.csv, homeworks/ и снимком
+(или базой sqlite), свои индексы, очереди проверки и кэши. Общие у всех курсов
+только токен, соединение с телеграмом, ограничение частоты отправки и пул потоков.
+
+Курсы перечисляются в config.yaml:
+    courses:
+      python-spring: courses/python-spring
+      ml:
+        dir: courses/ml
+        storage: sqlite
+        assistant_weights: {'@assistant': 2}
+Настройки курса - это общие настройки config.yaml, поверх которых наложены
+его собственные. Без раздела courses курс один, в текущей папке, как раньше.
+"""
+import asyncio
+import logging
+import os
+
+from assignment import InspectorAssigner
+from blocking import BlockingExecutor
+from homeworks import HomeworkStore
+from identity import IdentityIndex
+from locks import KeyedLock
+from metrics import METRICS
+from report import ReportCache
+from review import ReviewPrefetcher, ReviewQueues
+from roster import RosterWatcher
+from storage import course_files, course_settings, open_storage
+
+logger = logging.getLogger(__name__)
+
+
+class Course:
+    """Таблицы, сданные файлы, очереди проверки и кэши одного курса."""
+
+    def __init__(self, name: str, root: str, config: dict, blocking: BlockingExecutor):
+        self.name = name
+        self.root = root
+        self.config = config
+        self.blocking = blocking
+        self.hwdir = os.path.normpath(os.path.join(root, 'homeworks'))
+        # в assistants.csv роли Куратор, Преподаватель или Ассистент
+        self.students, self.admins = course_files(root)
+        os.makedirs(self.hwdir, exist_ok=True)
+
+        # csv держатся в памяти и пишутся пачками, sqlite пишется построчно
+        self.store = open_storage(config, self.students, self.admins)
+        self.identities = IdentityIndex(self.store)
+        # сданные файлы лежат по хэшу содержимого, история пересдач в homeworks/versions.csv
+        self.homeworks = HomeworkStore(self.hwdir, blocking, self.store)
+        self.homeworks.load()
+        self.reviews = ReviewQueues(self.store, self.queued_at)
+        self.report = ReportCache(self.store)
+        self.assigner = InspectorAssigner(self.store, self.reviews, config.get('assistant_weights'))
+        # изменения одной сдачи (студент, номер дз) идут по очереди
+        self.submission_locks = KeyedLock()
+        # подкачанные файлы одного курса не вытесняют файлы другого
+        self.prefetcher = ReviewPrefetcher(self.store, blocking, self.homeworks,
+                                           config.get('review_prefetch', 3),
+                                           max_bytes=int(config.get('cache_budget_mb', 32) * 2 ** 20))
+        self._tasks = []
+        # notify(id чатов, текст) - сообщение администраторам курса, задается в start
+        self.notify = None
+
+    @property
+    def lessons(self) -> list:
+        return self.store.lessons
+
+    @property
+    def lessons_passed(self) -> int:
+        return self.store.lessons_passed
+
+    def start(self, notify=None):
+        """Фоновые задачи курса: сброс таблиц на диск и слежение за списками."""
+        self.notify = notify
+        self._tasks.append(asyncio.create_task(self.store.run_flusher(self.blocking.run)))
+        if self.store.roster_paths() and self.config.get('roster_reload', True):
+            watcher = RosterWatcher(self.store, self.config.get('roster_poll_interval', 2.0))
+            self._tasks.append(asyncio.create_task(watcher.run(self.reload_roster, self.blocking.run)))
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self.prefetcher.clear()
+
+    async def reload_roster(self, paths: list[str]):
+        """Применяет правки списков, сделанные руками, ко всем индексам в памяти."""
+        diff = await self.blocking.run(self.store.reload, paths)
+        if diff.rejected is not None:
+            logger.error('Edit of %s was not applied, rows must not be reordered or deleted: %s',
+                         self.students, diff.rejected)
+            METRICS.errors['roster_rejected'] += 1
+            if self.notify is not None:
+                self.notify(self.admin_chats(), (
+                    f'Правка {self.students} не применена: {diff.rejected}. Студент определяется номером строки, '
+                    'поэтому строки нельзя переставлять и удалять (чтобы убрать студента, очистите его ячейки). '
+                    'Пока файл не исправлен, бот работает со старым списком и файл не перезаписывает.'))
+        # сначала убираем все старые ники, потом добавляем новые
+        for _, old, _ in diff.students:
+            if old is not None:
+                self.identities.remove_student(old['Ник'])
+        for student_id, _, new in diff.students:
+            if new is not None:
+                self.identities.set_student(student_id, new)
+        for admin in diff.admins_removed:
+            self.identities.remove_admin(admin['Ник'])
+        for admin in diff.admins_added:
+            self.identities.set_admin(admin)
+        if diff.lessons:
+            # таблица читается в пуле потоков; если за это время очереди поправила
+            # сдача или оценка, прочитанное могло устареть, и чтение повторяется
+            while True:
+                changes = self.reviews.changes
+                submissions = await self.blocking.run(self.reviews.read_lessons, diff.lessons)
+                if self.reviews.changes == changes:
+                    break
+            self.reviews.rebuild_lessons(diff.lessons, submissions)
+            self.prefetcher.clear()
+        if diff.students:
+            self.report.invalidate()
+        else:
+            for lesson in diff.lessons:
+                self.report.invalidate(lesson)
+        logger.info('Reloaded %s: %d students, %d admins changed, lessons %s',
+                    ', '.join(paths), len(diff.students),
+                    len(diff.admins_removed) + len(diff.admins_added), sorted(diff.lessons))
+
+    # Изменения одной сдачи. Каждое читает и меняет и таблицу, и очереди проверки
+    # через await, поэтому идет под замком сдачи (см. benchmarks/stress_writes.py).
+
+    async def submit(self, student_id: int, lesson: int, save, file_id):
+        """Принимает сдачу; save() кладет файл в хранилище дз и возвращает путь.
+
+        Возвращает проверяющего этой работы.
+        """
+        async with self.submission_locks((student_id, lesson)):
+            # уже известный файл (например, общий для группы) повторно не качается
+            filepath = await save()
+            await self.blocking.run(self.store.update_submission, student_id, lesson, hw_path=filepath)
+            # новый file_id заодно сбрасывает file_id прошлой сдачи
+            await self.blocking.run(self.store.set_file_id, student_id, lesson, file_id)
+            sub = await self.blocking.run(self.store.submission, student_id, lesson)
+            self.reviews.submitted(student_id, lesson, sub['inspector'], graded=sub['mark'] is not None)
+            self.prefetcher.invalidate(student_id, lesson)
+            self.report.invalidate(lesson)
+        return sub['inspector']
+
+    async def comment(self, student_id: int, lesson: int, text: str):
+        async with self.submission_locks((student_id, lesson)):
+            await self.blocking.run(self.store.update_submission, student_id, lesson, comment=text)
+            self.prefetcher.invalidate(student_id, lesson)
+
+    async def grade(self, student_id: int, lesson: int, mark: str):
+        async with self.submission_locks((student_id, lesson)):
+            await self.blocking.run(self.store.update_submission, student_id, lesson, mark=mark)
+            sub = await self.blocking.run(self.store.submission, student_id, lesson)
+            self.reviews.graded(student_id, lesson, sub['inspector'])
+            self.report.invalidate(lesson)
+
+    async def move(self, student_id: int, lesson: int, old, new):
+        """Передает работу другому проверяющему."""
+        async with self.submission_locks((student_id, lesson)):
+            await self.blocking.run(self.store.update_submission, student_id, lesson, inspector=new)
+            self.reviews.reassign(student_id, lesson, old, new)
+            self.report.invalidate(lesson)
+
+    def submitted_at(self, student_id: int, lesson: int):
+        """Время последней сдачи по истории версий, None для сдач без истории."""
+        versions = self.homeworks.versions(student_id, lesson)
+        return versions[-1].time if versions else None
+
+    def queued_at(self, student_id: int, lesson: int):
+        """Время первой сдачи: пересдача не меняет место работы в очереди."""
+        versions = self.homeworks.versions(student_id, lesson)
+        return versions[0].time if versions else None
+
+    async def debtors(self, lesson: int) -> list[int]:
+        """Студенты, не сдавшие дз; одно чтение занятия в пуле потоков вместо запроса на студента."""
+        def read():
+            submitted = {sid for sid, sub in self.store.lesson_submissions(lesson) if sub['hw_path'] is not None}
+            return [sid for sid in self.store.student_ids() if sid not in submitted]
+        return await self.blocking.run(read)
+
+    def admin_chats(self) -> list[int]:
+        chat_ids = self.store.chat_ids()
+        return [chat_ids[admin['Ник']] for admin in self.store.admins if admin['Ник'] in chat_ids]
+
+    def student_chats(self, student_ids) -> list[int]:
+        chat_ids = self.store.chat_ids()
+        nicks = (self.store.student(sid)['Ник'] for sid in student_ids)
+        return [chat_ids[nick] for nick in nicks if nick in chat_ids]
+
+
+def open_courses(config: dict, blocking: BlockingExecutor) -> dict[str, Course]:
+    return {name: Course(name, root, settings, blocking)
+            for name, (root, settings) in course_settings(config).items()}
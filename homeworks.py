@@ -0,0 +1,217 @@
+"""Сданные файлы дз, адресованные по содержимому.
+
+Каждый файл лежит на диске один раз, в homeworks/blobs/<ab>/<sha256><расширение>,
+сколько бы студентов его ни сдали, и именно этот путь пишется в hw_path.
+Имена файлов больше не могут затереть друг друга, а пересдача не перезаписывает
+прошлую версию. История сдач (кто, какое дз, какой файл и когда) дописывается
+в homeworks/versions.csv; студент в ней узнается по нику, так что строки
+students.csv, переставленные пока бот остановлен, не отдают ему чужую историю.
+Файл, чей file_unique_id телеграма уже встречался, повторно не скачивается.
+
+Старые версии и файлы, на которые ничего не ссылается, убирает сборщик мусора:
+    python homeworks.py gc            # оставить по 3 последние версии каждой сдачи
+    python homeworks.py gc --keep 1   # только текущие
+Файлы старого вида homeworks/<n>/<имя>_<файл> сборщик не трогает.
+"""
+import argparse
+import csv
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import NamedTuple
+
+from blocking import BlockingExecutor, Downloader
+from metrics import METRICS
+from storage import Storage, add_course_arguments, cli_courses, readonly_storages, student_row
+
+logger = logging.getLogger(__name__)
+
+# Ник дописан в конец: в старых файлах его нет, и запись берет студента из колонки student
+VERSION_COLUMNS = ['student', 'lesson', 'sha256', 'file_unique_id', 'filename', 'size', 'time', 'Ник']
+# файлы моложе этого сборщик не трогает: они могут докачиваться или еще
+# не попасть в таблицу (бот сбрасывает ее на диск не сразу)
+GRACE_SECONDS = 3600
+
+
+class Version(NamedTuple):
+    sha256: str
+    file_unique_id: str
+    filename: str
+    size: int
+    time: float
+    path: str
+
+
+class HomeworkStore:
+    def __init__(self, root: str, blocking: BlockingExecutor, storage: Storage):
+        self.root = root
+        self.blocking = blocking
+        self.storage = storage
+        self.blobs_dir = os.path.join(root, 'blobs')
+        self.versions_path = os.path.join(root, 'versions.csv')
+        # (студент, дз) -> версии от старой к новой
+        self._versions = {}
+        self._by_unique = {}
+        self._paths = {}
+        # дописывание в versions.csv идет из пула потоков
+        self._lock = threading.Lock()
+
+    def load(self):
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        self._versions = {}
+        self._by_unique = {}
+        self._paths = {}
+        if not os.path.exists(self.versions_path):
+            return
+        # файл только дописывается самим ботом, так что хватает модуля csv без pandas
+        METRICS.storage_io('read', os.path.getsize(self.versions_path))
+        students = ((sid, self.storage.student(sid)) for sid in self.storage.student_ids())
+        rows = {student['Ник']: sid for sid, student in students if student['Ник']}
+        with open(self.versions_path, encoding='utf-8', newline='') as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            for record in (dict(zip(VERSION_COLUMNS, values)) for values in reader):
+                self._remember(student_row(rows, record), int(record['lesson']), record['sha256'],
+                               record['file_unique_id'], record['filename'], int(record['size']),
+                               float(record['time']))
+
+    def blob_path(self, sha256: str, filename: str) -> str:
+        ext = os.path.splitext(filename)[1].lower()
+        return os.path.join(self.blobs_dir, sha256[:2], sha256 + ext)
+
+    def versions(self, student_id: int, lesson: int) -> list[Version]:
+        return list(self._versions.get((student_id, lesson), ()))
+
+    def filename(self, student_id: int, lesson: int):
+        """Исходное имя последней сданной версии."""
+        versions = self._versions.get((student_id, lesson))
+        return versions[-1].filename if versions else None
+
+    async def save(self, downloader: Downloader, file, student_id: int, lesson: int, filename: str) -> str:
+        """Сохраняет сданный telegram.File и возвращает путь до него.
+
+        Если такой file_unique_id уже скачивался и файл на месте, скачивания нет,
+        а если совпало содержимое, скачанная копия выбрасывается.
+        """
+        sha256 = self._by_unique.get(file.file_unique_id)
+        path = self._paths.get(sha256)
+        # у переиспользуемого файла обновляется время изменения, чтобы сборщик мусора
+        # не удалил его, пока новая ссылка на него еще не записана в таблицу
+        download = path is None or not await self.blocking.run(_touch, path)
+        if download:
+            fd, tmp_path = await self.blocking.run(
+                tempfile.mkstemp, dir=self.blobs_dir, prefix='.incoming', suffix='.part')
+            await self.blocking.run(os.close, fd)
+            try:
+                sha256 = await downloader.download(file, tmp_path)
+                path = self._paths.get(sha256) or self.blob_path(sha256, filename)
+                await self.blocking.run(self._store_blob, tmp_path, path)
+            except BaseException:
+                await self.blocking.run(_unlink, tmp_path)
+                raise
+        size = file.file_size or await self.blocking.run(os.path.getsize, path)
+        if not download:
+            METRICS.storage_io('download_skipped', size)
+        await self.blocking.run(self._record, student_id, lesson, sha256, file.file_unique_id,
+                                filename, size, time.time())
+        return path
+
+    @staticmethod
+    def _store_blob(tmp_path: str, path: str):
+        if _touch(path):
+            METRICS.storage_io('duplicate', os.path.getsize(tmp_path))
+            os.unlink(tmp_path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+    def _record(self, student_id: int, lesson: int, sha256: str, file_unique_id: str,
+                filename: str, size: int, timestamp: float):
+        with self._lock:
+            new = not os.path.exists(self.versions_path)
+            with open(self.versions_path, 'a', encoding='utf-8', newline='') as file:
+                writer = csv.writer(file)
+                if new:
+                    writer.writerow(VERSION_COLUMNS)
+                writer.writerow([student_id, lesson, sha256, file_unique_id, filename, size, timestamp,
+                                 self.storage.student(student_id)['Ник'] or ''])
+            METRICS.storage_io('write')
+            self._remember(student_id, lesson, sha256, file_unique_id, filename, size, timestamp)
+
+    def _remember(self, student_id: int, lesson: int, sha256: str, file_unique_id: str,
+                  filename: str, size: int, timestamp: float):
+        path = self._paths.setdefault(sha256, self.blob_path(sha256, filename))
+        if file_unique_id:
+            self._by_unique[file_unique_id] = sha256
+        self._versions.setdefault((student_id, lesson), []).append(
+            Version(sha256, file_unique_id, filename, size, timestamp, path))
+
+    def gc(self, storage: Storage, keep: int = 3) -> tuple[int, int]:
+        """Удаляет файлы, на которые не ссылается ни одна сдача и ни одна
+        из keep последних версий. Возвращает число удаленных файлов и байт.
+
+        Последняя версия остается всегда: ссылка на нее может быть пока только
+        в памяти бота. Записи в versions.csv остаются, так что история пересдач
+        не теряется.
+        """
+        live = {os.path.normpath(sub['hw_path'])
+                for _, _, sub in storage.iter_submissions() if sub['hw_path'] is not None}
+        for versions in self._versions.values():
+            live.update(os.path.normpath(v.path) for v in versions[-max(keep, 1):])
+        removed = freed = 0
+        now = time.time()
+        for directory, _, names in os.walk(self.blobs_dir):
+            for name in names:
+                path = os.path.normpath(os.path.join(directory, name))
+                if path in live:
+                    continue
+                stat = os.stat(path)
+                if now - stat.st_mtime < GRACE_SECONDS:
+                    continue
+                os.unlink(path)
+                removed += 1
+                freed += stat.st_size
+        return removed, freed
+
+
+def _touch(path: str) -> bool:
+    """Обновляет время изменения файла; False, если файла нет."""
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сборка мусора в хранилище сданных дз')
+    commands = parser.add_subparsers(dest='command', required=True)
+    gc = commands.add_parser('gc', help='удалить файлы, на которые больше ничего не ссылается')
+    add_course_arguments(gc)
+    gc.add_argument('--root', default=None, help='папка дз, по умолчанию homeworks в папке курса')
+    gc.add_argument('--keep', type=int, default=None, help='сколько последних версий каждой сдачи хранить')
+    args = parser.parse_args()
+
+    courses = cli_courses(args)
+    blocking = BlockingExecutor(1)
+    for name, root, settings, storage in readonly_storages(courses):
+        homeworks = HomeworkStore(args.root or os.path.normpath(os.path.join(root, 'homeworks')),
+                                  blocking, storage)
+        homeworks.load()
+        keep = args.keep if args.keep is not None else settings.get('homework_versions', 3)
+        removed, freed = homeworks.gc(storage, keep)
+        prefix = f'{name}: ' if len(courses) > 1 else ''
+        print(f'{prefix}Удалено файлов: {removed}, освобождено {freed / 2 ** 20:.1f} МБ')
+    blocking.shutdown()
+
+if __name__ == '__main__':
+    main()
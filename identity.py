@@ -0,0 +1,83 @@
+"""Индекс ник -> роль для /start, /help и проверок прав.
+
+Строится один раз по хранилищу и дальше поправляется точечно
+при изменении списков, так что авторизация - это один поиск в словаре.
+"""
+from typing import NamedTuple, Optional
+
+from storage import Storage
+
+ROLE_HEADERS = {
+    'Куратор': 'Куратор, отвечающий за организацию курса:\n',
+    'Преподаватель': 'Любимые преподаватели:\n',
+    'Ассистент': 'Ассистенты, всегда рады ответить на любой вопрос, а еще проверяют домашки:\n',
+}
+
+
+class Identity(NamedTuple):
+    auth: str               # 'student' или 'admin'
+    id: Optional[int]       # id студента в хранилище, у организаторов None
+    name: str
+    role: Optional[str]     # Куратор, Преподаватель или Ассистент
+
+
+class IdentityIndex:
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self._students = {}
+        self._admins = {}
+        self._contacts = None
+        # растет при любой правке, по нему обработчики видят, что роль надо перепроверить
+        self.version = 0
+        self.rebuild()
+
+    def rebuild(self):
+        self._students = {}
+        for student_id in self.storage.student_ids():
+            self.set_student(student_id, self.storage.student(student_id))
+        self._admins = {}
+        for admin in self.storage.admins:
+            self.set_admin(admin)
+
+    def lookup(self, username: str) -> Optional[Identity]:
+        """Студенты важнее организаторов, как и раньше в /start."""
+        return self._students.get(username) or self._admins.get(username)
+
+    def set_student(self, student_id: int, student: dict):
+        if student['Ник']:
+            self._students[student['Ник']] = Identity('student', student_id, student['Имя'], None)
+        self.version += 1
+
+    def remove_student(self, username: str):
+        self._students.pop(username, None)
+        self.version += 1
+
+    def set_admin(self, admin: dict):
+        if admin['Ник']:
+            self._admins[admin['Ник']] = Identity('admin', None, admin['Имя'], admin['Роль'])
+        self._contacts = None
+        self.version += 1
+
+    def remove_admin(self, username: str):
+        self._admins.pop(username, None)
+        self._contacts = None
+        self.version += 1
+
+    def curator(self) -> dict:
+        for nick, admin in self._admins.items():
+            if admin.role == 'Куратор':
+                return {'Имя': admin.name, 'Ник': nick}
+        return {'Имя': 'Имя', 'Ник': 'Ник'}
+
+    def contacts(self) -> str:
+        """Текст /contacts без строки про бота, пересобирается только после правок списка."""
+        if self._contacts is None:
+            groups = {}
+            for nick, admin in self._admins.items():
+                groups.setdefault(admin.role, []).append(f'{admin.name}: {nick}')
+            message = 'Прошу любить и жаловать участвующих в организации курса)\n\n'
+            for group, lines in groups.items():
+                message += ROLE_HEADERS.get(group, f'Я не уверен, но написано {group}:\n')
+                message += '\n'.join(lines) + '\n'
+            self._contacts = message
+        return self._contacts
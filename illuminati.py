@@ -1,11 +1,13 @@
+import asyncio
+import importlib.util
 import logging
 
-import os
+import time
+from collections import Counter
 from datetime import date
-from random import choices as randchoices
 import yaml
-import pandas as pd
-from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove, Update
+from telegram import InputFile, InputMediaDocument, ReplyKeyboardMarkup, ReplyKeyboardRemove, Update
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -15,6 +17,13 @@ from telegram.ext import (
     filters,
 )
 
+from blocking import BlockingExecutor, Downloader, LoopLagMonitor
+from course import Course, open_courses
+from metrics import METRICS, dump_periodically, instrument_application, serve as serve_metrics
+from outbox import Broadcaster, OutboundLimiter
+from review import CAPTION_LIMIT
+from updates import PerUserUpdateProcessor
+
 logger = logging.getLogger(__name__)
 
 HW_NUM, HW_FILE, HW_QUESTION = range(3)
@@ -25,12 +34,17 @@ class IlluminatiBot:
         'start': 'Запустить бота и авторизоваться по спискам',
         'help': 'Получить список доступных команд',
         'contacts': 'Получить список сотрудников курса с обьяснением ролей',
+        'course name': 'Выбрать курс, если ты участвуешь в нескольких (без названия - список твоих курсов)',
     }
     commands = {
         'admin':{
             **common_commands,
             'add_day date': 'Добавить дату очередного прошедшего дня занятий'\
                 'и распределить проверяющих\n (если без даты, то сегодня)',
+            'remind num': 'Напомнить о дз num всем, кто его еще не сдал',
+            'reassign hours': 'Передать работы, которые ждут проверки дольше hours часов, менее загруженным проверяющим',
+            'report (csv)': 'Отчет по занятиям, студентам и проверяющим в xlsx (или в csv)',
+            'stats': 'Статистика работы бота: задержки, ошибки, обращения к хранилищу и телеграму',
             # not implemented
             'check_hw': 'Проверить домашние задания за определенный день'
 
@@ -42,32 +56,37 @@ class IlluminatiBot:
                 ' или использовать сокращенный вариант\n к примеру: /hw 3',
         },
     }
-    def __init__(self):
-        self.hwdir = 'homeworks'
-        self.students = 'students.csv'
-        self.admins = 'assistants.csv'# Роли могут быть Куратор, Преподаватель или Ассистент
-        self.lessons_passed = 0
-        self.lessons = []
-
-        if not os.path.exists(self.hwdir):
-            os.makedirs(self.hwdir)
-        if not os.path.exists(self.students):
-            pd.DataFrame(columns=['Имя', 'Ник']).to_csv(self.students, index=False)
-        else:
-            last_col_name = pd.read_csv(self.students).columns[-1]
-            if last_col_name[0] in '0123456789':
-                self.lessons_passed = int(last_col_name.split('_', 1)[0])
-        if not os.path.exists(self.admins):
-            pd.DataFrame(columns=['Имя', 'Ник', 'Роль']).to_csv(self.admins, index=False)
-
-        self.hw_ids = pd.DataFrame(
-                index=pd.read_csv(self.students)['Имя'],
-                columns=range(1, self.lessons_passed+1)
-                )
-
-        with open("config.yaml", "r") as file:
-            token = yaml.safe_load(file)['token']
-        application = Application.builder().token(token).build()
+    def __init__(self, config_path: str = 'config.yaml'):
+        with open(config_path, "r") as file:
+            self.config = yaml.safe_load(file)
+
+        self.broadcaster = None
+        # диск и хранилище трогаем только из пула потоков, он общий для всех курсов
+        self.blocking = BlockingExecutor(self.config.get('io_threads', 4))
+        self.downloader = Downloader(self.blocking, self.config.get('download_chunk_size', 1 << 20))
+        self.loop_lag = LoopLagMonitor()
+        self._lag_task = None
+        self._metrics_tasks = []
+        self._metrics_server = None
+        # у каждого курса свои таблицы, файлы, очереди и кэши (раздел courses в config.yaml)
+        self.courses = open_courses(self.config, self.blocking)
+
+        # один токен и один ограничитель отправки на все курсы
+        limits = self.config.get('rate_limits', {})
+        builder = (
+            Application.builder()
+            .token(self.config['token'])
+            .rate_limiter(OutboundLimiter(**limits))
+            # обновления разных пользователей идут параллельно, одного - по порядку
+            .concurrent_updates(PerUserUpdateProcessor(self.config.get('concurrent_updates', 16)))
+            .post_init(self.post_init)
+            .post_stop(self.post_stop)
+            .post_shutdown(self.post_shutdown)
+        )
+        if 'base_url' in self.config:
+            # например, локальный Bot API сервер или его заглушка для нагрузочных тестов
+            builder = builder.base_url(self.config['base_url']).base_file_url(self.config['base_file_url'])
+        application = builder.build()
         self.application = application
 
         # Add start and help commands handler
@@ -80,6 +99,14 @@ class IlluminatiBot:
 
         day_handler = CommandHandler("add_day", self.add_day)
         application.add_handler(day_handler)
+        remind_handler = CommandHandler("remind", self.remind)
+        application.add_handler(remind_handler)
+        reassign_handler = CommandHandler("reassign", self.reassign)
+        application.add_handler(reassign_handler)
+        report_handler = CommandHandler("report", self.send_report)
+        application.add_handler(report_handler)
+        stats_handler = CommandHandler("stats", self.stats)
+        application.add_handler(stats_handler)
 
         # Add conversation handler
         hw_handler = ConversationHandler(
@@ -104,7 +131,9 @@ class IlluminatiBot:
                     )
                 ],
             },
-            fallbacks=[CommandHandler('cancel', self.hw_cancel)],
+            # смена курса посреди диалога его завершает
+            fallbacks=[CommandHandler('cancel', self.hw_cancel), CommandHandler('course', self.choose_course)],
+            name='hw',
         )
         application.add_handler(hw_handler)
 
@@ -122,6 +151,7 @@ class IlluminatiBot:
                     ),
                     CommandHandler('next', self.ch_next),
                     CommandHandler('task', self.ch_task),
+                    CommandHandler('bulk', self.ch_bulk),
                 ],
                 CH_STUD: [
                     MessageHandler(
@@ -130,131 +160,347 @@ class IlluminatiBot:
                     CommandHandler('next', self.ch_next),
                     CommandHandler('task', self.ch_task),
                     CommandHandler('all', self.ch_all),
+                    CommandHandler('bulk', self.ch_bulk),
                 ],
             },
-            fallbacks=[CommandHandler('cancel', self.ch_cancel)],
+            fallbacks=[CommandHandler('cancel', self.ch_cancel), CommandHandler('course', self.choose_course)],
+            name='ch',
         )
         application.add_handler(ch_handler)
+        # после диалогов, чтобы внутри диалога /course досталась его fallbacks
+        course_handler = CommandHandler("course", self.choose_course)
+        application.add_handler(course_handler)
+
+        # время, ошибки и переходы состояний всех обработчиков выше
+        instrument_application(application, {
+            'hw': {HW_NUM: 'HW_NUM', HW_FILE: 'HW_FILE', HW_QUESTION: 'HW_QUESTION'},
+            'ch': {CH_NUM: 'CH_NUM', CH_DAY: 'CH_DAY', CH_STUD: 'CH_STUD'},
+        })
+
+    def courses_of(self, username) -> list[Course]:
+        """Курсы, в списках которых есть этот ник."""
+        if not username:
+            return []
+        return [c for c in self.courses.values() if c.identities.lookup('@' + username) is not None]
+
+    def course(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Курс пользователя: выбранный через /course, а если курс у него один - этот."""
+        if len(self.courses) == 1:
+            return next(iter(self.courses.values()))
+        course = self.courses.get(context.user_data.get('course'))
+        if course is None:
+            found = self.courses_of(update.effective_user.username)
+            if len(found) != 1:
+                return None
+            course = found[0]
+            context.user_data['course'] = course.name
+        return course
+
+    def auth(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Роль пользователя в его курсе из user_data, а если /start еще не было
+        или списки с тех пор правили - из индекса по нику."""
+        course = self.course(update, context)
+        if course is None:
+            context.user_data.pop('auth', None)
+            return None
+        roster = (course.name, course.identities.version)
+        if 'auth' not in context.user_data or context.user_data.get('roster') != roster:
+            username = update.effective_user.username
+            identity = course.identities.lookup('@' + username) if username else None
+            if identity is None:
+                context.user_data.pop('auth', None)
+                # из выбранного курса пользователя убрали, при следующем обращении ищем заново
+                context.user_data.pop('course', None)
+                return None
+            context.user_data['auth'] = identity.auth
+            context.user_data['roster'] = roster
+            if identity.auth == 'student':
+                context.user_data['num'] = identity.id
+        return context.user_data['auth']
+
+    async def deny(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Ответ на команду не для роли пользователя. Кто есть в нескольких курсах
+        и еще не выбрал курс, получает подсказку про /course."""
+        found = self.courses_of(update.effective_user.username)
+        if self.course(update, context) is None and len(found) > 1:
+            await update.message.reply_text(
+                'Ты есть в списках нескольких курсов, сначала выбери, с каким работаем сейчас:\n' +
+                '\n'.join(f'/course {course.name}' for course in found))
+        else:
+            await update.message.reply_text('Похоже вы пытаетесь сделать что-то не то...')
 
-    def update_hw_ids_index(self):
-        if(len(pd.read_csv(self.students)) != len(self.hw_ids)) or (
-            (pd.read_csv(self.students)['Имя'] != self.hw_ids.index).any() ):
-            self.hw_ids = pd.merge(
-                pd.read_csv(self.students)['Имя'].to_frame().set_index('Имя'),
-                self.hw_ids,
-                left_index=True,
-                right_index=True
-                     )
+    async def post_init(self, application: Application):
+        self._lag_task = asyncio.create_task(self.loop_lag.run())
+        self.broadcaster = Broadcaster(application.bot)
+        for course in self.courses.values():
+            course.start(self.broadcaster.broadcast)
+        if 'metrics_file' in self.config:
+            self._metrics_tasks.append(asyncio.create_task(dump_periodically(self.config['metrics_file'])))
+        if 'metrics_port' in self.config:
+            self._metrics_server = await serve_metrics('127.0.0.1', self.config['metrics_port'])
+
+    async def post_stop(self, application: Application):
+        # обработчики к этому моменту уже доработали, а бот еще может отправлять
+        try:
+            await asyncio.wait_for(self.broadcaster.join(), self.config.get('shutdown_timeout', 10))
+        except asyncio.TimeoutError:
+            logger.warning('Broadcast was not finished before shutdown')
+        await self.broadcaster.close()
+
+    async def post_shutdown(self, application: Application):
+        for task in (self._lag_task, *self._metrics_tasks):
+            if task is not None:
+                task.cancel()
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+        await self.downloader.close()
+        for course in self.courses.values():
+            course.stop()
+            await self.blocking.run(course.store.close)
+        self.blocking.shutdown()
+        logger.info('Event loop lag: %s', self.loop_lag.summary())
 
     def run(self):
         """Run the bot until the user presses Ctrl-C"""
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if self.config.get('mode', 'polling') == 'webhook':
+            self.run_webhook(self.config['webhook'])
+        else:
+            self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+    def run_webhook(self, webhook: dict):
+        # сервер вебхуков PTB работает на tornado
+        if importlib.util.find_spec('tornado') is None:
+            raise SystemExit('Для mode: webhook нужен пакет python-telegram-bot[webhooks] '
+                             '(pip install -r requirements.txt)')
+        loop = asyncio.get_event_loop()
+        try:
+            self.application.run_webhook(
+                listen=webhook.get('listen', '127.0.0.1'),
+                port=webhook.get('port', 8443),
+                url_path=webhook.get('url_path', ''),
+                webhook_url=webhook.get('url'),
+                secret_token=webhook.get('secret_token'),
+                allowed_updates=Update.ALL_TYPES,
+                close_loop=False,
+            )
+        finally:
+            # если сервер вебхуков не поднялся, приложение не должно остаться запущенным
+            if self.application.running:
+                logger.warning('Webhook server stopped unexpectedly, stopping the application')
+                loop.run_until_complete(self.application.stop())
+                loop.run_until_complete(self.post_stop(self.application))
+                loop.run_until_complete(self.application.shutdown())
+                loop.run_until_complete(self.post_shutdown(self.application))
+            loop.close()
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         username = '@' + update.effective_chat.username
         name = update.effective_chat.first_name
-        student_df = pd.read_csv(self.students)
-        admin_df = pd.read_csv(self.admins)
-        if (username == student_df['Ник']).any():
+        found = self.courses_of(update.effective_chat.username)
+        for course in found:
+            # без id чата боту нечем писать пользователю первым (рассылки)
+            await self.blocking.run(course.store.set_chat_id, username, update.effective_chat.id)
+        if context.user_data.get('course') not in {course.name for course in found}:
+            context.user_data.pop('course', None)
+        course = self.course(update, context)
+        identity = course.identities.lookup(username) if course is not None else None
+        if identity is None and len(found) > 1:
+            message = (
+            f'Добро пожаловать, {name}!\n'
+            'Ты есть в списках нескольких курсов, выбери, с каким работаем сейчас '
+            '(переключиться можно в любой момент):\n' +
+            '\n'.join(f'/course {course.name}' for course in found))
+        elif identity is not None and identity.auth == 'student':
             context.user_data['auth'] = 'student'
-            context.user_data['num'] = student_df.query(f"Ник == '{username}'").index[0]
+            context.user_data['num'] = identity.id
             message = (
             'Ты, похоже, учащийся курса)\n' 
             f'Добро пожаловать, {name}!\n' 
             'Этого бота можно использовать для сдачи домашнего задания, ' 
             'а также для получения списка контактов преподавателей и их ассистентов.\n'
             'Желаем приятного обучения!')
-        elif (username == admin_df['Ник']).any():
+        elif identity is not None:
             context.user_data['auth'] = 'admin'
             message = (
             'Ты, похоже, тут главный)\n'
             f'Добро пожаловать, {name}!\n'
-            f'У тебя роль {admin_df.loc[admin_df['Ник']==username, 'Роль'].item()}.\n'
+            f'У тебя роль {identity.role}.\n'
             'Этот бот тут для помощи тебе).')
-        else:
-            if len(admin_df) > 0:
-                curator = admin_df.query('Роль == "Куратор"').iloc[0]
-            else:
-                curator = {'Имя':'Имя', 'Ник':'Ник'}
+        elif course is not None:
+            curator = course.identities.curator()
             message = (
             f'Мы не смогли найти тебя в списках, {name}!\n'
             'Если такого не должно быть, то просим написать куратору курса '
             f'{curator['Имя']}:{curator['Ник']}')
+        else:
+            message = (
+            f'Мы не смогли найти тебя в списках, {name}!\n'
+            'Если такого не должно быть, то просим написать куратору своего курса')
+        if identity is not None and len(found) > 1:
+            message += f'\n\nСейчас выбран курс {course.name}, сменить - /course'
         await update.message.reply_text(message)
 
     async def help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if 'auth' not in context.user_data:
+        auth = self.auth(update, context)
+        if auth is None:
             await update.message.reply_text(
                                       'Сначала выполните команду /start для авторизации'
+                                      ' (или выберите курс командой /course)'
                                       )
-        elif context.user_data['auth'] == 'admin':
+        elif auth == 'admin':
             await update.message.reply_text(
-                f'список команд для администратора:\n' +
+                'список команд для администратора:\n' +
                 '\n'.join(f'/{command}:\n {descr}' for command, descr in self.commands['admin'].items())
             )
-        elif context.user_data['auth'] == 'student':
+        elif auth == 'student':
             await update.message.reply_text(
-                f'список команд для студента:\n' +
+                'список команд для студента:\n' +
                 '\n'.join(f'/{command}:\n {descr}' for command, descr in self.commands['student'].items())
             )
         else:
-            print(f"user @{update.effective_user.username} has undetected role {context.user_data['auth']}")
+            logger.warning('User @%s has undetected role %s', update.effective_user.username, auth)
+            METRICS.errors['unknown_role'] += 1
             await update.message.reply_text('Role not recognized')
 
     async def contacts(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        admins_df = pd.read_csv(self.admins)
-        message = 'Прошу любить и жаловать участвующих в организации курса)\n\n'
-        for group, df in admins_df.groupby('Роль', sort=False):
-            if group == 'Куратор':
-                message += 'Куратор, отвечающий за организацию курса:\n'
-            elif group == 'Преподаватель':
-                message += 'Любимые преподаватели:\n'
-            elif group == 'Ассистент':
-                message += 'Ассистенты, всегда рады ответить на любой вопрос, а еще проверяют домашки:\n'
-            else:
-                message += f'Я не уверен, но написано {group}:\n'
-            message += '\n'.join(row['Имя']+': '+row['Ник'] for _, row in df.iterrows())+'\n'
+        course = self.course(update, context)
+        if course is None:
+            await update.message.reply_text('Сначала выберите курс командой /course')
+            return
+        message = course.identities.contacts()
         message += 'Ну и я, скромный бот:\n@'+update.get_bot().username
         await update.message.reply_text(message)
 
+    async def choose_course(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        """Список курсов пользователя или выбор одного из них. Начатый диалог при этом завершается."""
+        found = self.courses_of(update.effective_user.username)
+        if not context.args:
+            current = context.user_data.get('course')
+            text = 'Мы не нашли тебя в списках ни одного курса' if not found else \
+                'Твои курсы:\n' + '\n'.join(
+                    f'/course {course.name}' + (' (выбран)' if course.name == current else '') for course in found)
+            await update.message.reply_text(text)
+            return ConversationHandler.END
+        name = ' '.join(context.args)
+        course = next((course for course in found if course.name == name), None)
+        if course is None:
+            await update.message.reply_text('Такого курса нет среди твоих, список - /course')
+            return ConversationHandler.END
+        # номер студента, дз и очередь проверки относятся к прежнему курсу
+        for key in ('auth', 'roster', 'num', 'hw_num', 'stud_num', 'batch'):
+            context.user_data.pop(key, None)
+        context.user_data['course'] = course.name
+        await update.message.reply_text(f'Выбран курс {course.name}', reply_markup=ReplyKeyboardRemove())
+        return ConversationHandler.END
+
     async def add_day(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if context.user_data['auth'] != 'admin':
-            await update.message.reply_text('Похоже вы пытаетесь сделать что-то не то...')
+        if self.auth(update, context) != 'admin':
+            await self.deny(update, context)
             return
+        course = self.course(update, context)
         if not context.args:
             date_to_add = date.today().strftime("%d-%m-%Y")
         else:
             date_to_add = context.args[0]
 
-        self.lessons.append(date_to_add)
-        self.lessons_passed = len(self.lessons)
-        student_df = pd.read_csv(self.students)
-        assistants = pd.read_csv(self.admins).query("Роль == 'Ассистент'")['Ник'].to_list()
-        if not assistants: assistants = [None]
-        self.update_hw_ids_index()
-        self.hw_ids.loc[:, str(self.lessons_passed)] = None
-        n = str(self.lessons_passed)
-        path = os.path.join(self.hwdir, str(n))
-        if not os.path.exists(path):
-            os.makedirs(path)
-
-        student_df.loc[:, 'day_'+n+'_'+date_to_add] = None
-        student_df.loc[:, 'day_'+n+'_hw_path'] = None
-        student_df.loc[:, 'day_'+n+'_inspector'] = \
-            randchoices(assistants, k = len(student_df))
-        student_df.loc[:, 'day_'+n+'_comment'] = None
-        student_df.loc[:, 'day_'+n+'_mark'] = None
-        student_df.to_csv(self.students, index=False)
+        # поровну с учетом непроверенного, по возможности тот же проверяющий, что и в прошлый раз
+        inspectors = await self.blocking.run(course.assigner.assign_lesson, course.lessons_passed + 1,
+                                             course.reviews.backlog())
+        student_ids = list(inspectors)
+        n = await self.blocking.run(course.store.add_lesson, date_to_add, inspectors)
+        for student_id, inspector in inspectors.items():
+            course.reviews.assign(student_id, n, inspector)
+        course.report.invalidate(n)
+        self.broadcaster.broadcast(
+            course.student_chats(student_ids),
+            f'Добавлено занятие {n} ({date_to_add}).\n'
+            f'Домашнее задание можно сдать командой /hw {n}')
 
         await update.message.reply_text(f'Добавлена дата {date_to_add}')
 
+    async def remind(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if self.auth(update, context) != 'admin':
+            await self.deny(update, context)
+            return
+        course = self.course(update, context)
+        if not context.args or not context.args[0].isdigit() or not 1 <= int(context.args[0]) <= course.lessons_passed:
+            await update.message.reply_text('Нужно указать номер дз, к примеру: /remind 3')
+            return
+        n = int(context.args[0])
+        debtors = await course.debtors(n)
+        chats = course.student_chats(debtors)
+        self.broadcaster.broadcast(
+            chats, f'Напоминаем, что домашнее задание {n} еще ждет тебя) Сдать его можно командой /hw {n}')
+        await update.message.reply_text(
+            f'Напоминание отправляется {len(chats)} студентам из {len(debtors)} не сдавших '
+            '(остальные еще не писали боту)')
+
+    async def reassign(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if self.auth(update, context) != 'admin':
+            await self.deny(update, context)
+            return
+        course = self.course(update, context)
+        if context.args and context.args[0].isdigit():
+            hours = int(context.args[0])
+        else:
+            hours = course.config.get('stale_after_hours', 72)
+        stale = course.assigner.stale(course.submitted_at, hours * 3600, time.time())
+        moves = course.assigner.plan_reassign(stale)
+        for student_id, lesson, old, new in moves:
+            await course.move(student_id, lesson, old, new)
+        chat_ids = course.store.chat_ids()
+        received = Counter(new for _, _, _, new in moves)
+        self.broadcaster.broadcast(
+            [chat_ids[nick] for nick in received if nick in chat_ids],
+            'Вам переданы работы, которые давно ждут проверки. Посмотреть их можно командой /check_hw')
+        await update.message.reply_text(
+            f'Ждут проверки дольше {hours} ч: {len(stale)}, передано: {len(moves)}\n' +
+            '\n'.join(f'{nick}: +{count}' for nick, count in received.most_common()))
+
+    async def send_report(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if self.auth(update, context) != 'admin':
+            await self.deny(update, context)
+            return
+        course = self.course(update, context)
+        fmt = 'csv' if context.args and context.args[0] == 'csv' else course.config.get('report_format', 'xlsx')
+        # пересчитываются только занятия, изменившиеся с прошлого отчета
+        files = await self.blocking.run(course.report.render, fmt)
+        summary = await self.blocking.run(course.report.summary)
+        if len(files) == 1:
+            filename, data = files[0]
+            await update.message.reply_document(InputFile(data, filename=filename), caption=summary)
+            return
+        await update.message.reply_media_group([
+            InputMediaDocument(InputFile(data, filename=filename, attach=True),
+                               caption=summary if i == len(files) - 1 else None)
+            for i, (filename, data) in enumerate(files)
+        ])
+
+    async def stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if self.auth(update, context) != 'admin':
+            await self.deny(update, context)
+            return
+        lag = self.loop_lag.summary()
+        text = (METRICS.summary() +
+                f'\n\nЗадержка цикла событий p50/p99/max, мс: '
+                f'{lag['p50'] * 1000:.1f}/{lag['p99'] * 1000:.1f}/{lag['max'] * 1000:.1f}\n'
+                f'Обновлений в обработке: {self.application.update_processor.in_flight}\n'
+                f'Курсов: {len(self.courses)}, файлов подготовлено для проверки: '
+                f'{sum(c.prefetcher.held_bytes() for c in self.courses.values()) / 2 ** 20:.1f} МБ')
+        for start in range(0, len(text), 4000):
+            await update.message.reply_text(text[start:start + 4000])
+
     async def hw_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Starts the homework handling."""
-        if context.user_data['auth'] != 'student':
-            await update.message.reply_text('Похоже вы пытаетесь сделать что-то не то...')
+        if self.auth(update, context) != 'student':
+            await self.deny(update, context)
             return ConversationHandler.END
+        course = self.course(update, context)
 
-        if context.args:
+        if not course.lessons_passed:
+            await update.message.reply_text('Занятий пока не было, сдавать еще нечего)')
+            return ConversationHandler.END
+        if context.args and self.valid_lesson(course, context.args[0]):
             context.user_data['hw_num'] = int(context.args[0])
             await update.message.reply_text(
                 'Отлично!\n'\
@@ -263,7 +509,7 @@ class IlluminatiBot:
             )
             return HW_FILE
         else:
-            reply_keyboard = [[str(b) for b in range(max(self.lessons_passed - 3, 1), self.lessons_passed + 1)]]
+            reply_keyboard = [[str(b) for b in range(max(course.lessons_passed - 3, 1), course.lessons_passed + 1)]]
             await update.message.reply_text(
                 'Отлично!'\
                 'Пришли, пожалуйста, номер домашнего задания, которое хочешь сдать.\n'\
@@ -274,8 +520,18 @@ class IlluminatiBot:
                 )
             return HW_NUM
 
+    @staticmethod
+    def valid_lesson(course: Course, text: str) -> bool:
+        """Номер уже прошедшего занятия: сдача за будущее занятие потерялась бы."""
+        return text.isdigit() and 1 <= int(text) <= course.lessons_passed
+
     async def hw_num(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Записывает номер дз и отправляется ждать файл"""
+        course = self.course(update, context)
+        if not self.valid_lesson(course, update.message.text):
+            await update.message.reply_text(
+                f'Такого занятия еще не было, пришли номер от 1 до {course.lessons_passed}')
+            return HW_NUM
         context.user_data['hw_num'] = int(update.message.text)
         await update.message.reply_text(
         'Отлично!\n'\
@@ -285,24 +541,17 @@ class IlluminatiBot:
         return HW_FILE
 
     async def hw_file(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-        """Сохраняет файл в указанную папку и отмечает в таблице путь до него."""
-        student_df = pd.read_csv(self.students)
-        hw_ids_df = self.hw_ids
+        """Сохраняет файл в хранилище дз и отмечает в таблице путь до него."""
+        course = self.course(update, context)
         row = context.user_data['num']
-        col = f'day_{context.user_data['hw_num']}_hw_path'
-        name = student_df.loc[row, 'Имя']
-        path = os.path.join(self.hwdir, f'{context.user_data['hw_num']}')
-        # качаем в path файл и добавляем к названию имя студента
-        file = await update.message.document.get_file()
-        filename = file.file_path.replace('\\', '/').split('/')[-1]
-        filepath = os.path.join(path, name + '_' + filename)
-        await file.download_to_drive(filepath)
-        student_df.loc[row, col] = filepath
-        hw_ids_df.loc[name, context.user_data['hw_num']] = file.file_id
-        student_df.to_csv(self.students, index=False)
-        insp_col = f'day_{context.user_data['hw_num']}_inspector'
-        inspector = '' if not student_df.loc[row, insp_col] else \
-            f'''Проверять будет {student_df.loc[row, insp_col]}\n'''
+        day = context.user_data['hw_num']
+        document = update.message.document
+        file = await document.get_file()
+        filename = document.file_name or file.file_path.replace('\\', '/').split('/')[-1]
+        insp = await course.submit(row, day, lambda: course.homeworks.save(self.downloader, file, row, day, filename),
+                                   document.file_id)
+        inspector = '' if not insp else \
+            f'''Проверять будет {insp}\n'''
         await update.message.reply_text(
             'Файл получен)\n'+
             inspector+
@@ -316,14 +565,13 @@ class IlluminatiBot:
 
     async def hw_question(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Записывает вопрос или комментарий в таблицу"""
-        student_df = pd.read_csv(self.students)
+        course = self.course(update, context)
         row = context.user_data['num']
-        col = f'day_{context.user_data['hw_num']}_comment'
+        day = context.user_data['hw_num']
         comment = update.message.text
-        student_df.loc[row, col] = comment
-        student_df.to_csv(self.students, index=False)
+        await course.comment(row, day, comment)
         await update.message.reply_text(
-        f"""Проверяющий увидит твой комментарий)""")
+        'Проверяющий увидит твой комментарий)')
         return await self.hw_end(update, context)
 
     async def hw_end(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -343,43 +591,98 @@ class IlluminatiBot:
         )
         return ConversationHandler.END
 
-    def ch_get_all(self, assistant: str, context_data: dict) -> str:
+    @staticmethod
+    def ch_get_all(course: Course, assistant: str, context_data: dict) -> str:
         day = context_data['hw_num']
         assistant = '@'+assistant
-        to_check = pd.read_csv(self.students).query(f"day_{day}_inspector == '{assistant}'")
-        amount = len(to_check)
-        not_handled = to_check.loc[to_check[f"day_{day}_hw_path"].isna()]
-        handled = to_check.loc[to_check[f"day_{day}_hw_path"].notna()]
-        to_check = handled.loc[handled[f"day_{day}_mark"].isna()]
-        context_data['to_check'] = to_check
-        context_data['to_check_set'] = {idx for idx in to_check.index}
-
-        message = f'Всего за этот день необходимо проверить {amount} работ, причем {len(not_handled)} еще не сдано\n'\
-                  f'Сейчас осталось проверить {len(to_check)} заданий:\n'\
-                  '\n'.join(f'{n} '+row['Имя'] for n, row in to_check.iterrows())
-        return message
+        amount = course.reviews.assigned_count(day, assistant)
+        not_handled = course.reviews.not_submitted_count(day, assistant)
+        to_check = course.reviews.pending(day, assistant)
+        context_data.pop('stud_num', None)
+        context_data.pop('batch', None)
+
+        header = f'Всего за этот день необходимо проверить {amount} работ, причем {not_handled} еще не сдано\n'\
+                 f'Сейчас осталось проверить {len(to_check)} заданий:\n'
+        return header + '\n'.join(f'{n} '+(course.store.student(n)['Имя'] or '') for n in to_check)
 
     async def ch_get_stud(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        course = self.course(update, context)
         stud_num = context.user_data['stud_num']
-        stud = pd.read_csv(self.students).loc[stud_num]
         day = context.user_data['hw_num']
-        text = f'{stud['Имя']}: {stud['Ник']}'
-        if stud[f'day_{day}_comment']:
-            text +='\n Комментарий:\n' + stud[f'day_{day}_comment']
-        await update.message.reply_text(text)
+        prepared = await course.prefetcher.get(stud_num, day)
+        caption = prepared.caption if len(prepared.caption) <= CAPTION_LIMIT else None
+        if caption is None:
+            await update.message.reply_text(prepared.caption)
+        if prepared.file_id is not None:
+            try:
+                await update.message.reply_document(prepared.file_id, caption=caption)
+                self.prefetch_next(update, context)
+                return CH_STUD
+            except BadRequest:
+                logger.info('Cached file_id for %s/%s is no longer valid', stud_num, day)
+                await self.blocking.run(course.store.set_file_id, stud_num, day, None)
+                prepared = await course.prefetcher.load(prepared)
+        self.prefetch_next(update, context)
+        file = InputFile(prepared.data, filename=prepared.filename)
+        message = await update.message.reply_document(file, caption=caption)
+        await self.blocking.run(course.store.set_file_id, stud_num, day, message.document.file_id)
+        return CH_STUD
+
+    def prefetch_next(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Начинает готовить следующие работы очереди, пока проверяется текущая."""
+        course = self.course(update, context)
+        day = context.user_data['hw_num']
+        current = context.user_data.get('stud_num')
+        assistant = '@' + update.message.from_user.username
+        upcoming = course.reviews.peek(day, assistant, course.prefetcher.depth + 1)
+        course.prefetcher.prefetch((num, day) for num in upcoming if num != current)
+
+    async def ch_bulk(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        """Присылает сразу несколько работ одним альбомом, оценки ставятся ответом на файл."""
+        course = self.course(update, context)
+        day = context.user_data['hw_num']
+        assistant = '@' + update.message.from_user.username
+        size = min(int(context.args[0]), 10) if context.args and context.args[0].isdigit() else 5
+        batch = course.reviews.peek(day, assistant, size)
+        if len(batch) < 2:
+            return await self.ch_next(update, context)
+        prepared = [await course.prefetcher.get(num, day) for num in batch]
+        media = [
+            InputMediaDocument(
+                p.file_id if p.file_id is not None else InputFile(p.data, filename=p.filename, attach=True),
+                caption=p.caption[:CAPTION_LIMIT],
+            )
+            for p in prepared
+        ]
         try:
-            file = self.hw_ids.loc[stud['Имя'], day]
-            if file is None: raise KeyError
-        except KeyError:
-            file = stud[f'day_{day}_hw_path']
-        file_id = await update.message.reply_document(file)
-        self.hw_ids.loc[stud['Имя'], day] = file_id
+            messages = await update.message.reply_media_group(media)
+        except BadRequest:
+            # один из file_id устарел, отправляем все файлы с диска
+            logger.info('Cached file_ids for lesson %s batch are no longer valid', day)
+            for num in batch:
+                await self.blocking.run(course.store.set_file_id, num, day, None)
+            prepared = [await course.prefetcher.load(p) for p in prepared]
+            media = [
+                InputMediaDocument(InputFile(p.data, filename=p.filename, attach=True),
+                                   caption=p.caption[:CAPTION_LIMIT])
+                for p in prepared
+            ]
+            messages = await update.message.reply_media_group(media)
+        for num, p, message in zip(batch, prepared, messages):
+            if p.file_id is None:
+                await self.blocking.run(course.store.set_file_id, num, day, message.document.file_id)
+        context.user_data['batch'] = {message.message_id: num for num, message in zip(batch, messages)}
+        context.user_data['stud_num'] = batch[0]
+        await update.message.reply_text(
+            'Оценку можно поставить ответом на файл, '
+            f'иначе она будет записана для {course.store.student(batch[0])['Имя']}')
+        self.prefetch_next(update, context)
         return CH_STUD
 
     async def ch_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Starts the homework checking."""
-        if context.user_data['auth'] != 'admin':
-            await update.message.reply_text('Похоже вы пытаетесь сделать что-то не то...')
+        if self.auth(update, context) != 'admin':
+            await self.deny(update, context)
             return ConversationHandler.END
 
         if context.args:
@@ -388,7 +691,7 @@ class IlluminatiBot:
             await update.message.reply_text(
                 'Отлично!\n' \
                 f'Начинаем проверку дз номер {context.user_data['hw_num']}.\n\n'+
-                self.ch_get_all(assistant, context.user_data),
+                self.ch_get_all(self.course(update, context), assistant, context.user_data),
             )
             return CH_DAY
         else:
@@ -400,13 +703,15 @@ class IlluminatiBot:
         await update.message.reply_text(
             'Отлично!\n'\
             f'Начинаем проверку дз номер {context.user_data['hw_num']}.\n\n'+
-                self.ch_get_all(assistant, context.user_data),
+                self.ch_get_all(self.course(update, context), assistant, context.user_data),
         )
         return CH_DAY
 
     async def ch_day(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        course = self.course(update, context)
         stud_num = int(update.message.text)
-        if stud_num not in context.user_data['to_check_set']:
+        assistant = '@' + update.message.from_user.username
+        if not course.reviews.is_pending(context.user_data['hw_num'], assistant, stud_num):
             text = 'Введен неверный номер, пожалуйста введите верный или /next'
             await update.message.reply_text(text)
             return CH_DAY
@@ -414,26 +719,43 @@ class IlluminatiBot:
         return await self.ch_get_stud(update, context)
 
     async def ch_stud(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-        student_df = pd.read_csv(self.students)
-        row = context.user_data['stud_num']
-        col = f'day_{context.user_data['hw_num']}_mark'
+        course = self.course(update, context)
+        batch = context.user_data.get('batch', {})
+        reply_to = update.message.reply_to_message
+        if reply_to is not None and reply_to.message_id in batch:
+            row = batch[reply_to.message_id]
+        else:
+            row = context.user_data['stud_num']
+        day = context.user_data['hw_num']
         mark = update.message.text
-        student_df.loc[row, col] = mark
-        student_df.to_csv(self.students, index=False)
-        context.user_data['to_check_set'].remove(row)
+        await course.grade(row, day, mark)
         await update.message.reply_text(
-            f"""Оценка записана""")
+            'Оценка записана')
+        # работы из альбома уже у проверяющего, второй раз их не шлем
+        for message_id, num in list(batch.items()):
+            if num == row:
+                del batch[message_id]
+        if batch:
+            context.user_data['stud_num'] = next(iter(batch.values()))
+            await update.message.reply_text(
+                f'Следующая работа из альбома: {course.store.student(context.user_data['stud_num'])['Имя']}')
+            return CH_STUD
         return await self.ch_next(update, context)
 
     async def ch_next(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-        s = context.user_data['to_check_set']
-        num = s.pop()
-        s.add(num)
+        course = self.course(update, context)
+        context.user_data.pop('batch', None)
+        assistant = '@' + update.message.from_user.username
+        num = course.reviews.next(context.user_data['hw_num'], assistant, skip=context.user_data.get('stud_num'))
+        if num is None:
+            await update.message.reply_text('Все сданные работы проверены) /task - выбрать другое дз')
+            return CH_DAY
         context.user_data['stud_num'] = num
         return await self.ch_get_stud(update, context)
 
     async def ch_task(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-        reply_keyboard = reply_keyboard = [[str(b) for b in range(max(self.lessons_passed - 3, 1), self.lessons_passed + 1)]]
+        course = self.course(update, context)
+        reply_keyboard = reply_keyboard = [[str(b) for b in range(max(course.lessons_passed - 3, 1), course.lessons_passed + 1)]]
         await update.message.reply_text(
             'Пришли номер дз, которое хочешь проверять.\n',
             reply_markup=ReplyKeyboardMarkup(
@@ -445,7 +767,7 @@ class IlluminatiBot:
     async def ch_all(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         assistant = update.message.from_user.username
         await update.message.reply_text(
-            self.ch_get_all(assistant, context.user_data),
+            self.ch_get_all(self.course(update, context), assistant, context.user_data),
         )
         return CH_DAY
 
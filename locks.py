@@ -0,0 +1,33 @@
+"""Мелкозернистые блокировки для обработчиков, меняющих одну сдачу."""
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class KeyedLock:
+    """Отдельный asyncio.Lock на каждый ключ, например (студент, номер дз).
+
+    Обработчики разных студентов не ждут друг друга, а изменения одной сдачи
+    идут строго по очереди. Замок удаляется, как только его никто не ждет.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._users = {}
+
+    @asynccontextmanager
+    async def __call__(self, key):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
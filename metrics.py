@@ -0,0 +1,196 @@
+"""Легкая встроенная статистика: задержки обработчиков, ошибки, ввод-вывод хранилища,
+время запросов к Bot API и переходы состояний диалогов.
+
+Все считается в памяти процесса в гистограммах с фиксированными корзинами,
+так что накладные расходы - пара сравнений и сложений на вызов.
+Статистику показывает команда /stats, а в формате Prometheus ее можно
+периодически писать в файл (metrics_file) или отдавать по HTTP (metrics_port).
+"""
+import asyncio
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# верхние границы корзин в секундах
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, p: float) -> float:
+        """Оценка сверху: граница корзины, в которую попадает p-й процентиль."""
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    def __init__(self):
+        self.handlers = {}
+        self.errors = Counter()
+        self.storage = Counter()
+        self.api = {}
+        self.states = Counter()
+        self._lock = threading.Lock()
+
+    def observe_handler(self, name: str, seconds: float):
+        self.handlers.setdefault(name, Histogram()).observe(seconds)
+
+    def observe_api(self, endpoint: str, seconds: float):
+        self.api.setdefault(endpoint, Histogram()).observe(seconds)
+
+    def storage_io(self, kind: str, nbytes: int = 0):
+        """kind - read или write; вызывается и из пула потоков, поэтому под замком."""
+        with self._lock:
+            self.storage[kind + '_calls'] += 1
+            self.storage[kind + '_bytes'] += nbytes
+
+    def storage_snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.storage)
+
+    def summary(self) -> str:
+        lines = ['Обработчики (вызовы, p50/p99 мс, ошибки):']
+        for name, hist in sorted(self.handlers.items()):
+            lines.append(f'{name}: {hist.count}, {hist.percentile(50) * 1000:g}/{hist.percentile(99) * 1000:g}, '
+                         f'{self.errors[name]}')
+        lines.append('\nBot API (вызовы, p50/p99 мс):')
+        for name, hist in sorted(self.api.items()):
+            lines.append(f'{name}: {hist.count}, {hist.percentile(50) * 1000:g}/{hist.percentile(99) * 1000:g}')
+        lines.append('\nХранилище:')
+        lines.extend(f'{key}: {value}' for key, value in sorted(self.storage_snapshot().items()))
+        lines.append('\nСостояния диалогов:')
+        lines.extend(f'{conv} -> {state}: {count}' for (conv, state), count in sorted(self.states.items()))
+        other = {key: value for key, value in self.errors.items() if key not in self.handlers}
+        if other:
+            lines.append('\nПрочие ошибки:')
+            lines.extend(f'{key}: {value}' for key, value in sorted(other.items()))
+        return '\n'.join(lines)
+
+    def prometheus(self) -> str:
+        lines = []
+
+        def histogram(metric: str, label: str, hists: dict):
+            lines.append(f'# TYPE {metric} histogram')
+            for name, hist in sorted(hists.items()):
+                seen = 0
+                for bound, count in zip(BUCKETS, hist.counts):
+                    seen += count
+                    lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {seen}')
+                lines.append(f'{metric}_bucket{{{label}="{name}",le="+Inf"}} {hist.count}')
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {hist.sum}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {hist.count}')
+
+        histogram('illuminati_handler_seconds', 'handler', self.handlers)
+        histogram('illuminati_bot_api_seconds', 'endpoint', self.api)
+        lines.append('# TYPE illuminati_errors_total counter')
+        lines.extend(f'illuminati_errors_total{{source="{key}"}} {value}' for key, value in sorted(self.errors.items()))
+        lines.append('# TYPE illuminati_storage_total counter')
+        lines.extend(f'illuminati_storage_total{{kind="{key}"}} {value}'
+                     for key, value in sorted(self.storage_snapshot().items()))
+        lines.append('# TYPE illuminati_conversation_transitions_total counter')
+        lines.extend(f'illuminati_conversation_transitions_total{{conversation="{conv}",state="{state}"}} {count}'
+                     for (conv, state), count in sorted(self.states.items()))
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+def instrument(callback, name: str, conversation: str = None, state_names: dict = None):
+    """Оборачивает обработчик: время, ошибки и (для диалогов) в какое состояние он перевел."""
+    from telegram.ext import ConversationHandler
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            result = await callback(update, context)
+        except Exception:
+            METRICS.errors[name] += 1
+            raise
+        finally:
+            METRICS.observe_handler(name, time.perf_counter() - started)
+        if conversation is not None:
+            state = 'END' if result == ConversationHandler.END else (state_names or {}).get(result, result)
+            METRICS.states[(conversation, state)] += 1
+        return result
+
+    return wrapper
+
+
+def instrument_application(application, state_names: dict = None):
+    """Оборачивает обработчики всех зарегистрированных в application хэндлеров.
+
+    state_names - имя диалога (ConversationHandler.name) -> {номер состояния: имя}.
+    """
+    from telegram.ext import ConversationHandler
+
+    state_names = state_names or {}
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                names = state_names.get(handler.name)
+                inner = list(handler.entry_points) + list(handler.fallbacks)
+                for state_handlers in handler.states.values():
+                    inner.extend(state_handlers)
+                for h in inner:
+                    h.callback = instrument(h.callback, h.callback.__name__, handler.name, names)
+            elif hasattr(handler, 'callback'):
+                handler.callback = instrument(handler.callback, handler.callback.__name__)
+
+
+async def dump_periodically(path: str, interval: float = 15.0):
+    """Пишет метрики в формате Prometheus в файл (например, для node_exporter textfile)."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            text = METRICS.prometheus()
+            await asyncio.to_thread(_write_text, path, text)
+        except Exception:
+            logger.exception('Failed to dump metrics to %s', path)
+
+
+def _write_text(path: str, text: str):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        file.write(text)
+    os.replace(tmp_path, path)
+
+
+async def serve(host: str, port: int):
+    """Минимальный HTTP-сервер, отдающий метрики на любой GET."""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while (await reader.readline()).strip():
+                pass
+            body = METRICS.prometheus().encode()
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                         b'Content-Length: ' + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,189 @@
+"""Исходящие сообщения: ограничение частоты запросов к Bot API и рассылки.
+
+OutboundLimiter подключается к Application и пропускает через себя все
+запросы бота: держит общий лимит и лимит на чат, повторяет запросы после
+RetryAfter и пропускает ответы пользователям вперед рассылок.
+Broadcaster поверх него рассылает сообщения по списку чатов, склеивая
+несколько ожидающих сообщений в один чат в одно.
+"""
+import asyncio
+import logging
+import time
+
+from telegram.error import Forbidden, RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096
+BROADCAST = {'priority': 'broadcast'}
+
+
+class TokenBucket:
+    """rate запросов в секунду с запасом capacity на короткие всплески."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Сколько ждать до следующего токена, 0 - можно отправлять."""
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class OutboundLimiter(BaseRateLimiter):
+    """Ограничитель запросов для Application.builder().rate_limiter(...).
+
+    Запросы с rate_limit_args=BROADCAST ждут, пока в очереди есть ответы
+    пользователям, поэтому рассылка не тормозит диалоги.
+    """
+
+    def __init__(self, overall_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 group_rate: float = 20 / 60, max_retries: int = 5):
+        self.overall = TokenBucket(overall_rate, overall_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._chats = {}
+        self._interactive_waiting = 0
+        self._paused_until = 0.0
+        self._lock = None
+
+    async def initialize(self):
+        self._lock = asyncio.Lock()
+
+    async def shutdown(self):
+        self._chats.clear()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._chats = {key: b for key, b in self._chats.items() if not b.idle()}
+            is_group = (isinstance(chat_id, int) and chat_id < 0) or str(chat_id).startswith('@')
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, 1 if is_group else self.chat_burst)
+        return bucket
+
+    async def _acquire(self, chat_id, broadcast: bool):
+        if not broadcast:
+            self._interactive_waiting += 1
+        try:
+            while True:
+                async with self._lock:
+                    pause = self._paused_until - time.monotonic()
+                    if broadcast and self._interactive_waiting:
+                        delay = 0.05
+                    else:
+                        bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+                        delay = max(pause, self.overall.delay(), bucket.delay() if bucket else 0.0)
+                        if delay <= 0:
+                            self.overall.take()
+                            if bucket is not None:
+                                bucket.take()
+                            return
+                await asyncio.sleep(delay)
+        finally:
+            if not broadcast:
+                self._interactive_waiting -= 1
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        broadcast = rate_limit_args is not None and rate_limit_args.get('priority') == 'broadcast'
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, broadcast)
+            started = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as error:
+                METRICS.errors['flood_control'] += 1
+                if attempt == self.max_retries:
+                    raise
+                delay = error.retry_after
+                delay = delay.total_seconds() if hasattr(delay, 'total_seconds') else float(delay)
+                # флуд-контроль у телеграма общий, поэтому ждут все запросы
+                delay += 0.5 * attempt
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                logger.warning('%s hit flood control, retrying in %.1f s', endpoint, delay)
+            finally:
+                METRICS.observe_api(endpoint, time.perf_counter() - started)
+
+
+class Broadcaster:
+    """Рассылка по многим чатам через OutboundLimiter.
+
+    Сообщения раскладываются по чатам, несколько еще не отправленных
+    сообщений в один чат склеиваются в одно. Рассылка идет в фоне
+    несколькими задачами, неудачная отправка в один чат не мешает остальным.
+    """
+
+    def __init__(self, bot, workers: int = 8):
+        self.bot = bot
+        self.workers = workers
+        self.sent = 0
+        self.failed = 0
+        self._pending = {}
+        self._ready = asyncio.Queue()
+        self._tasks = []
+
+    def broadcast(self, chat_ids, text: str):
+        """Ставит сообщение в очередь для каждого чата и сразу возвращает управление."""
+        for chat_id in chat_ids:
+            parts = self._pending.get(chat_id)
+            if parts is None:
+                self._pending[chat_id] = [text]
+                self._ready.put_nowait(chat_id)
+            elif parts and len(parts[-1]) + len(text) + 2 <= MESSAGE_LIMIT:
+                parts[-1] += '\n\n' + text
+            else:
+                parts.append(text)
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            try:
+                while self._pending.get(chat_id):
+                    text = self._pending[chat_id].pop(0)
+                    await self._send(chat_id, text)
+                self._pending.pop(chat_id, None)
+            finally:
+                self._ready.task_done()
+
+    async def _send(self, chat_id, text: str):
+        try:
+            await self.bot.send_message(chat_id, text, rate_limit_args=BROADCAST)
+            self.sent += 1
+        except Forbidden:
+            # пользователь заблокировал бота
+            self.failed += 1
+        except Exception:
+            self.failed += 1
+            logger.exception('Broadcast to %s failed', chat_id)
+
+    async def join(self):
+        """Ждет, пока все поставленные сообщения будут отправлены."""
+        await self._ready.join()
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
@@ -0,0 +1,245 @@
+"""Сводки для кураторов: по занятиям, по студентам и по проверяющим.
+
+Сдачи читаются по одному занятию за раз (Storage.lesson_submissions), и от
+каждого занятия в памяти остаются только компактные итоги. Сдача, оценка или
+новое занятие помечают свое занятие устаревшим, следующий отчет пересчитывает
+только его, а если ничего не менялось, отдает готовые таблицы.
+
+Отчет выгружается в csv (по файлу на таблицу) или в xlsx, если установлен openpyxl:
+    python report.py --format xlsx --out reports
+"""
+import argparse
+import csv
+import io
+import os
+import threading
+from collections import Counter
+
+from storage import Storage, add_course_arguments, cli_courses, readonly_storages
+
+LESSON_COLUMNS = ['Занятие', 'Дата', 'Студентов', 'Сдано', 'Доля сдавших', 'Проверено',
+                  'Ждут проверки', 'Средняя оценка', 'Оценки']
+STUDENT_COLUMNS = ['Имя', 'Ник', 'Сдано', 'Проверено', 'Средняя оценка', 'Не сдано']
+INSPECTOR_COLUMNS = ['Проверяющий', 'Назначено', 'Сдано', 'Проверено', 'Ждут проверки', 'Ждут по занятиям']
+
+
+def numeric(mark):
+    try:
+        return float(mark.replace(',', '.'))
+    except (AttributeError, ValueError):
+        return None
+
+
+def mean(values: list):
+    return round(sum(values) / len(values), 2) if values else None
+
+
+class LessonStats:
+    """Итоги одного занятия."""
+
+    def __init__(self, lesson: int, lesson_date: str):
+        self.lesson = lesson
+        self.date = lesson_date
+        self.students = 0
+        self.submitted = 0
+        self.graded = 0
+        self.marks = Counter()
+        # проверяющий -> [назначено, сдано, проверено]
+        self.inspectors = {}
+        # id студента -> оценка, None - сдано, но не проверено; не сдавших здесь нет
+        self.student_marks = {}
+
+    def add(self, student_id: int, sub: dict):
+        self.students += 1
+        counts = self.inspectors.setdefault(sub['inspector'], [0, 0, 0])
+        counts[0] += 1
+        if sub['hw_path'] is None:
+            return
+        self.submitted += 1
+        counts[1] += 1
+        self.student_marks[student_id] = sub['mark']
+        if sub['mark'] is not None:
+            self.graded += 1
+            counts[2] += 1
+            self.marks[sub['mark']] += 1
+
+
+class ReportCache:
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self._lessons = {}
+        self._dirty = set()
+        self._tables = None
+        # формат -> готовые файлы для тех же таблиц
+        self._rendered = {}
+        self._generation = 0
+        # отчет строится в пуле потоков, а помечается устаревшим из обработчиков
+        self._lock = threading.Lock()
+
+    def invalidate(self, lesson: int = None):
+        """Занятие изменилось; без номера - устарело все (например, поменялись списки)."""
+        with self._lock:
+            if lesson is None:
+                self._dirty.update(self._lessons)
+            else:
+                self._dirty.add(lesson)
+            self._tables = None
+            self._rendered = {}
+            self._generation += 1
+
+    def lesson_stats(self) -> list[LessonStats]:
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            stale = [n for n in range(1, self.storage.lessons_passed + 1)
+                     if n in dirty or n not in self._lessons]
+        fresh = {}
+        for n in stale:
+            stats = LessonStats(n, self.storage.lessons[n - 1])
+            for student_id, sub in self.storage.lesson_submissions(n):
+                stats.add(student_id, sub)
+            fresh[n] = stats
+        with self._lock:
+            self._lessons.update(fresh)
+            return [self._lessons[n] for n in range(1, self.storage.lessons_passed + 1)]
+
+    def tables(self) -> dict:
+        """Название таблицы -> (колонки, строки)."""
+        with self._lock:
+            if self._tables is not None:
+                return self._tables
+            generation = self._generation
+        lessons = self.lesson_stats()
+        tables = {
+            'lessons': (LESSON_COLUMNS, [self._lesson_row(s) for s in lessons]),
+            'students': (STUDENT_COLUMNS, self._student_rows(lessons)),
+            'inspectors': (INSPECTOR_COLUMNS, self._inspector_rows(lessons)),
+        }
+        with self._lock:
+            # пока считали, ничего не поменялось
+            if generation == self._generation:
+                self._tables = tables
+        return tables
+
+    @staticmethod
+    def _lesson_row(s: LessonStats) -> list:
+        marks = []
+        for mark, count in s.marks.items():
+            value = numeric(mark)
+            if value is not None:
+                marks.extend([value] * count)
+        return [
+            s.lesson, s.date, s.students, s.submitted,
+            round(s.submitted / s.students, 3) if s.students else None,
+            s.graded, s.submitted - s.graded, mean(marks),
+            ', '.join(f'{mark}: {count}' for mark, count in sorted(s.marks.items())),
+        ]
+
+    def _student_rows(self, lessons: list[LessonStats]) -> list:
+        rows = []
+        for student_id in self.storage.student_ids():
+            student = self.storage.student(student_id)
+            submitted = graded = 0
+            marks = []
+            missed = []
+            for s in lessons:
+                if student_id not in s.student_marks:
+                    missed.append(str(s.lesson))
+                    continue
+                submitted += 1
+                mark = s.student_marks[student_id]
+                if mark is not None:
+                    graded += 1
+                    if (value := numeric(mark)) is not None:
+                        marks.append(value)
+            rows.append([student['Имя'], student['Ник'], submitted, graded, mean(marks), ', '.join(missed)])
+        return rows
+
+    @staticmethod
+    def _inspector_rows(lessons: list[LessonStats]) -> list:
+        totals = {}
+        pending = {}
+        for s in lessons:
+            for inspector, counts in s.inspectors.items():
+                if inspector is None:
+                    continue
+                total = totals.setdefault(inspector, [0, 0, 0])
+                for i, count in enumerate(counts):
+                    total[i] += count
+                if counts[1] > counts[2]:
+                    pending.setdefault(inspector, []).append(f'{s.lesson}: {counts[1] - counts[2]}')
+        return [
+            [inspector, assigned, submitted, graded, submitted - graded, ', '.join(pending.get(inspector, ()))]
+            for inspector, (assigned, submitted, graded) in sorted(totals.items())
+        ]
+
+    def render(self, fmt: str = 'xlsx') -> list[tuple[str, bytes]]:
+        """Файлы отчета: [(имя, содержимое)]. Без openpyxl xlsx заменяется на csv."""
+        tables = self.tables()
+        files = self._rendered.get(fmt)
+        if files is not None and self._tables is tables:
+            return files
+        files = None
+        if fmt == 'xlsx':
+            try:
+                files = [('report.xlsx', to_xlsx(tables))]
+            except ImportError:
+                pass
+        if files is None:
+            files = [(f'{name}.csv', to_csv(*table)) for name, table in tables.items()]
+        with self._lock:
+            if self._tables is tables:
+                self._rendered[fmt] = files
+        return files
+
+    def summary(self) -> str:
+        lessons = self.lesson_stats()
+        submitted = sum(s.submitted for s in lessons)
+        graded = sum(s.graded for s in lessons)
+        return (f'Занятий: {len(lessons)}, студентов: {len(self.storage.student_ids())}\n'
+                f'Сдано работ: {submitted}, проверено: {graded}, ждут проверки: {submitted - graded}')
+
+
+def to_csv(columns: list, rows: list) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    writer.writerows(rows)
+    # BOM, чтобы Excel открыл кириллицу правильно
+    return buffer.getvalue().encode('utf-8-sig')
+
+
+def to_xlsx(tables: dict) -> bytes:
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for name, (columns, rows) in tables.items():
+        sheet = workbook.create_sheet(name)
+        sheet.append(columns)
+        for row in rows:
+            sheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Отчет по курсу для кураторов')
+    add_course_arguments(parser)
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='xlsx')
+    parser.add_argument('--out', default='.', help='папка для файлов отчета')
+    args = parser.parse_args()
+
+    courses = cli_courses(args)
+    for name, _, _, storage in readonly_storages(courses):
+        cache = ReportCache(storage)
+        # у нескольких курсов отчеты лежат по папкам с их названиями
+        out = args.out if len(courses) == 1 else os.path.join(args.out, name)
+        os.makedirs(out, exist_ok=True)
+        for filename, data in cache.render(args.format):
+            with open(os.path.join(out, filename), 'wb') as file:
+                file.write(data)
+            print(os.path.join(out, filename))
+        print(cache.summary())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""Очереди работ на проверку по (номер дз, проверяющий) и их подкачка.
+
+Очереди строятся по хранилищу один раз при старте и дальше поправляются
+при сдаче (hw_file) и оценке (ch_stud), так что /check_hw, /next и /all
+не трогают таблицы вовсе.
+"""
+import asyncio
+import logging
+import os
+from collections import Counter
+from typing import NamedTuple, Optional
+
+from blocking import BlockingExecutor
+from homeworks import HomeworkStore
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class ReviewQueues:
+    def __init__(self, storage: Storage, queued_at=None):
+        self.storage = storage
+        # queued_at(id студента, дз) - время, с которого работа стоит в очереди,
+        # или None; по нему восстанавливается порядок сдачи после перезапуска
+        self.queued_at = queued_at
+        # (дз, проверяющий) -> {id студента: None}, порядок ключей - порядок сдачи
+        self._pending = {}
+        # (дз, проверяющий) -> множество сдавших и число назначенных работ
+        self._submitted = {}
+        self._assigned = Counter()
+        # растет при каждой правке очередей: по нему видно, что очереди поменялись,
+        # пока read_lessons читал таблицу в пуле потоков
+        self.changes = 0
+        self.rebuild()
+
+    def rebuild(self):
+        self._pending = {}
+        self._submitted = {}
+        self._assigned = Counter()
+        for student_id, lesson, sub in self._in_order(self.storage.iter_submissions()):
+            self._add(student_id, lesson, sub)
+
+    def read_lessons(self, lessons) -> dict:
+        """Сдачи занятий в порядке сдачи: дз -> [(id студента, дз, сдача)].
+
+        Только читает хранилище, поэтому может идти в пуле потоков.
+        """
+        return {
+            lesson: list(self._in_order([(student_id, lesson, sub)
+                                         for student_id, sub in self.storage.lesson_submissions(lesson)]))
+            for lesson in sorted(set(lessons)) if lesson <= self.storage.lessons_passed
+        }
+
+    def rebuild_lessons(self, lessons, submissions: dict = None):
+        """Пересобирает очереди только этих занятий (например, после правки таблицы руками).
+
+        submissions - заранее прочитанные read_lessons сдачи, иначе они читаются здесь.
+        """
+        lessons = set(lessons)
+        if submissions is None:
+            submissions = self.read_lessons(lessons)
+        for table in (self._pending, self._submitted, self._assigned):
+            for key in [key for key in table if key[0] in lessons]:
+                del table[key]
+        for lesson in sorted(submissions):
+            for student_id, _, sub in submissions[lesson]:
+                self._add(student_id, lesson, sub)
+
+    def _in_order(self, submissions):
+        """Сдачи в порядке сдачи; сдачи без истории версий идут первыми, по id студента."""
+        if self.queued_at is None:
+            return submissions
+
+        def key(item):
+            at = self.queued_at(item[0], item[1]) if item[2]['hw_path'] is not None else None
+            return (at is not None, at or 0.0)
+        return sorted(submissions, key=key)
+
+    def _add(self, student_id: int, lesson: int, sub: dict):
+        self.assign(student_id, lesson, sub['inspector'])
+        if sub['hw_path'] is not None:
+            self.submitted(student_id, lesson, sub['inspector'], graded=sub['mark'] is not None)
+
+    def assign(self, student_id: int, lesson: int, inspector):
+        self.changes += 1
+        if inspector is not None:
+            self._assigned[(lesson, inspector)] += 1
+
+    def submitted(self, student_id: int, lesson: int, inspector, graded: bool = False):
+        """Работа сдана (или пересдана). Пересдача не меняет место в очереди."""
+        self.changes += 1
+        if inspector is None:
+            return
+        key = (lesson, inspector)
+        self._submitted.setdefault(key, set()).add(student_id)
+        if not graded:
+            self._pending.setdefault(key, {}).setdefault(student_id, None)
+
+    def graded(self, student_id: int, lesson: int, inspector):
+        self.changes += 1
+        queue = self._pending.get((lesson, inspector))
+        if queue is not None:
+            queue.pop(student_id, None)
+
+    def is_pending(self, lesson: int, inspector: str, student_id: int) -> bool:
+        return student_id in self._pending.get((lesson, inspector), ())
+
+    def pending(self, lesson: int, inspector: str) -> list[int]:
+        return list(self._pending.get((lesson, inspector), ()))
+
+    def peek(self, lesson: int, inspector: str, n: int) -> list[int]:
+        """Первые n работ очереди без изменения порядка."""
+        queue = self._pending.get((lesson, inspector), ())
+        return [student_id for student_id, _ in zip(queue, range(n))]
+
+    def pending_count(self, lesson: int, inspector: str) -> int:
+        return len(self._pending.get((lesson, inspector), ()))
+
+    def assigned_count(self, lesson: int, inspector: str) -> int:
+        return self._assigned[(lesson, inspector)]
+
+    def not_submitted_count(self, lesson: int, inspector: str) -> int:
+        return self._assigned[(lesson, inspector)] - len(self._submitted.get((lesson, inspector), ()))
+
+    def backlog(self) -> Counter:
+        """Проверяющий -> число непроверенных работ по всем занятиям."""
+        result = Counter()
+        for (_, inspector), queue in self._pending.items():
+            result[inspector] += len(queue)
+        return result
+
+    def all_pending(self):
+        """Все непроверенные работы: (номер дз, проверяющий, id студента)."""
+        for (lesson, inspector), queue in self._pending.items():
+            for student_id in queue:
+                yield lesson, inspector, student_id
+
+    def reassign(self, student_id: int, lesson: int, old, new):
+        """Передает работу другому проверяющему, непроверенная встает в конец его очереди."""
+        key = (lesson, old)
+        submitted = student_id in self._submitted.get(key, ())
+        pending = student_id in self._pending.get(key, ())
+        if old is not None:
+            self._assigned[key] -= 1
+            self._submitted.get(key, set()).discard(student_id)
+            self.graded(student_id, lesson, old)
+        self.assign(student_id, lesson, new)
+        if submitted:
+            self.submitted(student_id, lesson, new, graded=not pending)
+
+    def next(self, lesson: int, inspector: str, skip=None):
+        """Первая работа в очереди. Пропущенная работа skip уходит в конец очереди."""
+        queue = self._pending.get((lesson, inspector))
+        if not queue:
+            return None
+        if skip in queue and len(queue) > 1:
+            del queue[skip]
+            queue[skip] = None
+        return next(iter(queue))
+
+
+CAPTION_LIMIT = 1024
+
+
+class Prepared(NamedTuple):
+    """Все, что нужно, чтобы показать работу проверяющему одним сообщением."""
+    caption: str
+    file_id: Optional[str]
+    hw_path: str
+    data: Optional[bytes]   # содержимое файла, если file_id еще нет
+    filename: str           # имя файла для проверяющего
+
+
+def describe(student: dict, sub: dict) -> str:
+    text = f"{student['Имя']}: {student['Ник']}"
+    if sub['comment']:
+        text += '\n Комментарий:\n' + sub['comment']
+    return text
+
+
+class ReviewPrefetcher:
+    """Заранее готовит следующие работы из очереди, пока проверяется текущая.
+
+    Для работ без file_id файл читается с диска в фоне, чтобы отправка
+    следующей работы после оценки не ждала диска. Держит не больше
+    max_entries готовых работ и max_bytes прочитанных файлов, самые старые
+    выбрасываются.
+    """
+
+    def __init__(self, storage: Storage, blocking: BlockingExecutor, homeworks: HomeworkStore,
+                 depth: int = 3, max_entries: int = 64, max_bytes: int = 32 << 20):
+        self.storage = storage
+        self.blocking = blocking
+        self.homeworks = homeworks
+        self.depth = depth
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._tasks = {}
+
+    def prefetch(self, keys):
+        for key in keys:
+            if key not in self._tasks:
+                task = asyncio.create_task(self._prepare(*key))
+                task.add_done_callback(self._evict)
+                self._tasks[key] = task
+        self._evict()
+
+    def held_bytes(self) -> int:
+        """Сколько байт файлов держат уже готовые работы."""
+        return sum(_size(task) for task in self._tasks.values())
+
+    def _evict(self, _=None):
+        # размер известен только после чтения файла, поэтому проверяем и по его окончании
+        while self._tasks and (len(self._tasks) > self.max_entries or self.held_bytes() > self.max_bytes):
+            self._tasks.pop(next(iter(self._tasks))).cancel()
+
+    async def get(self, student_id: int, lesson: int) -> Prepared:
+        task = self._tasks.pop((student_id, lesson), None)
+        if task is not None:
+            try:
+                return await task
+            except Exception:
+                logger.exception('Prefetch of %s/%s failed', student_id, lesson)
+        return await self._prepare(student_id, lesson)
+
+    async def load(self, prepared: Prepared) -> Prepared:
+        """Та же работа, но с файлом с диска (если file_id оказался недействителен)."""
+        return prepared._replace(file_id=None, data=await self.blocking.read_bytes(prepared.hw_path))
+
+    def invalidate(self, student_id: int, lesson: int):
+        task = self._tasks.pop((student_id, lesson), None)
+        if task is not None:
+            task.cancel()
+
+    def clear(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks = {}
+
+    async def _prepare(self, student_id: int, lesson: int) -> Prepared:
+        # с sqlite это запросы к базе, поэтому в пуле потоков
+        sub, file_id = await self.blocking.run(
+            lambda: (self.storage.submission(student_id, lesson), self.storage.file_id(student_id, lesson)))
+        student = self.storage.student(student_id)
+        original = self.homeworks.filename(student_id, lesson)
+        # старые сдачи уже лежат под именем <имя>_<файл>
+        filename = os.path.basename(sub['hw_path']) if original is None else f"{student['Имя']}_{original}"
+        prepared = Prepared(describe(student, sub), file_id, sub['hw_path'], None, filename)
+        if prepared.file_id is None:
+            prepared = await self.load(prepared)
+        return prepared
+
+
+def _size(task: asyncio.Task) -> int:
+    if not task.done() or task.cancelled() or task.exception() is not None:
+        return 0
+    data = task.result().data
+    return len(data) if data is not None else 0
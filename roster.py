@@ -0,0 +1,88 @@
+"""Слежение за списками, которые кураторы правят руками (students.csv, assistants.csv).
+
+Раз в interval секунд сравнивает время изменения и размер файлов, а если
+установлен inotify_simple, просыпается сразу по событию файловой системы.
+Файл перечитывается, только когда он поменялся не из-за записи самого бота
+и перестал меняться (редактор мог сохранять его в несколько приемов).
+"""
+import asyncio
+import logging
+import os
+
+from storage import Storage, file_stamp
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+logger = logging.getLogger(__name__)
+
+
+class RosterWatcher:
+    def __init__(self, storage: Storage, interval: float = 2.0, settle: float = 0.5):
+        self.storage = storage
+        self.paths = storage.roster_paths()
+        self.interval = interval
+        self.settle = settle
+        # правки, сделанные до начала слежения (например, пока бот стоял), тоже подхватываются
+        self._seen = {path: storage.written_stamp(path) for path in self.paths}
+
+    def changed(self) -> list[str]:
+        """Файлы, поменявшиеся с прошлой проверки не из-за записи бота."""
+        result = []
+        for stamp in file_stamp(self.paths):
+            path = stamp[0]
+            if stamp == self._seen.get(path):
+                continue
+            self._seen[path] = stamp
+            # удаленный файл перечитывать нечего
+            if stamp[1] is not None and stamp != self.storage.written_stamp(path):
+                result.append(path)
+        return result
+
+    async def run(self, on_change, run_blocking):
+        """Вызывает await on_change(пути) на каждую правку, пока задачу не отменят.
+
+        run_blocking - корутина вида run(func), выносящая stat из цикла событий.
+        """
+        wakeup = asyncio.Event()
+        inotify = self._watch(wakeup)
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                wakeup.clear()
+                if inotify is not None:
+                    inotify.read(timeout=0)
+                paths = await run_blocking(self.changed)
+                if not paths:
+                    continue
+                # ждем, пока файл перестанет меняться
+                while True:
+                    await asyncio.sleep(self.settle)
+                    more = await run_blocking(self.changed)
+                    if not more:
+                        break
+                    paths = sorted(set(paths) | set(more))
+                try:
+                    await on_change(paths)
+                except Exception:
+                    logger.exception('Failed to reload %s', ', '.join(paths))
+        finally:
+            if inotify is not None:
+                asyncio.get_running_loop().remove_reader(inotify.fileno())
+                inotify.close()
+
+    def _watch(self, wakeup: asyncio.Event):
+        if INotify is None or not self.paths:
+            return None
+        inotify = INotify()
+        # csv подменяются целиком (и ботом, и многими редакторами), поэтому следим за папками
+        mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+        for directory in {os.path.dirname(os.path.abspath(path)) for path in self.paths}:
+            inotify.add_watch(directory, mask)
+        asyncio.get_running_loop().add_reader(inotify.fileno(), wakeup.set)
+        return inotify
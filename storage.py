@@ -0,0 +1,1085 @@
+"""Хранилища данных курса: студенты, ассистенты, занятия и сдачи дз.
+
+Есть два бэкенда с одинаковым интерфейсом Storage:
+CsvStorage держит прежние широкие csv в памяти и сбрасывает их на диск пачками,
+SqliteStorage хранит сдачи в нормализованной базе и пишет их построчно.
+
+CsvStorage при остановке сохраняет снимок (pickle) всех таблиц рядом с csv,
+и при следующем старте, если csv с тех пор не менялись, читает его вместо них.
+pandas импортируется только когда csv действительно надо прочитать или записать.
+
+Запуск как скрипта переносит csv в sqlite или выгружает базу обратно в csv:
+    python storage.py migrate students.csv assistants.csv course.db
+    python storage.py export course.db students.csv assistants.csv
+"""
+import argparse
+import asyncio
+import logging
+import os
+import pathlib
+import pickle
+import shutil
+import sqlite3
+import tempfile
+import threading
+from typing import NamedTuple
+
+import yaml
+
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+STUDENT_COLUMNS = ['Имя', 'Ник']
+ADMIN_COLUMNS = ['Имя', 'Ник', 'Роль']
+FILE_ID_COLUMNS = ['student', 'Ник', 'lesson', 'file_id']
+CHAT_ID_COLUMNS = ['Ник', 'chat_id']
+SUBMISSION_FIELDS = ('hw_path', 'inspector', 'comment', 'mark')
+
+
+def read_csv_records(path: str) -> tuple[list[str], list[dict]]:
+    """Читает csv как строки, пустые ячейки превращаются в None."""
+    import pandas as pd
+
+    METRICS.storage_io('read', os.path.getsize(path))
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    records = [
+        {col: (value if value != '' else None) for col, value in row.items()}
+        for row in df.to_dict('records')
+    ]
+    return list(df.columns), records
+
+
+def atomic_write_csv(path: str, columns: list[str], records: list[dict]):
+    """Пишет таблицу во временный файл рядом и атомарно подменяет им исходный."""
+    import pandas as pd
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as file:
+            pd.DataFrame(records, columns=columns).to_csv(file, index=False)
+        METRICS.storage_io('write', os.path.getsize(tmp_path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def lesson_column(lesson: int, field: str) -> str:
+    return f'day_{lesson}_{field}'
+
+
+SNAPSHOT_VERSION = 1
+
+
+def file_stamp(paths: list[str]) -> tuple:
+    """Время изменения и размер файлов: по ним видно, правили ли их после снимка."""
+    stamp = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stamp.append((path, None, None))
+        else:
+            stamp.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(stamp)
+
+
+def load_snapshot(path: str, stamp: tuple):
+    """Данные снимка или None, если его нет, он поврежден или сделан не с файлов stamp."""
+    try:
+        with open(path, 'rb') as file:
+            version, saved_stamp, data = pickle.load(file)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.warning('Snapshot %s is unreadable, ignoring it', path)
+        return None
+    if version != SNAPSHOT_VERSION or saved_stamp != stamp:
+        return None
+    METRICS.storage_io('read', os.path.getsize(path))
+    return data
+
+
+def save_snapshot(path: str, stamp: tuple, data):
+    """stamp - file_stamp тех версий файлов, с которыми совпадают данные."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            pickle.dump((SNAPSHOT_VERSION, stamp, data), file, protocol=pickle.HIGHEST_PROTOCOL)
+        METRICS.storage_io('write', os.path.getsize(tmp_path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def moved_row(rows: dict, records: list[dict]):
+    """Описание первой строки списка, которая сменила номер, или None.
+
+    rows - ник -> id студента (номер строки) до правки, records - строки файла.
+    """
+    for row, record in enumerate(records):
+        old = rows.get(record['Ник'])
+        if old is not None and old != row:
+            # номера строк как в редакторе: первая строка - заголовок
+            return f'{record["Ник"]} перемещен со строки {old + 2} на строку {row + 2}'
+    return None
+
+
+def admins_diff(old: list[dict], new: list[dict]) -> tuple[list, list]:
+    """Ассистенты, которых убрали или поменяли, и добавленные или поменянные."""
+    old = {a['Ник']: a for a in old}
+    new = {a['Ник']: a for a in new}
+    return ([a for nick, a in old.items() if new.get(nick) != a],
+            [a for nick, a in new.items() if old.get(nick) != a])
+
+
+def student_row(rows: dict, record: dict) -> int:
+    """id студента для записи file_ids.csv или versions.csv.
+
+    rows - ник -> id студента. Студент ищется по нику, так что переставленные
+    строки его не путают; записи без ника (старые файлы) и с ником, которого
+    в списке больше нет (ник поправили), берут id из колонки student.
+    """
+    return rows.get(record.get('Ник'), int(record['student']))
+
+
+def drop_snapshot(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class RosterDiff(NamedTuple):
+    """Что поменялось в списках после правки руками."""
+    students: list      # (id, было, стало), None - строки не было или больше нет
+    admins_removed: list
+    admins_added: list
+    lessons: set        # занятия, в колонках которых что-то поменялось
+    rejected: str       # почему правка students.csv не применена, None - применена
+
+
+class Storage:
+    """Общий интерфейс хранилищ.
+
+    Студент адресуется целым id (в csv это номер строки), студент и ассистент
+    отдаются словарями с ключами 'Имя', 'Ник' (и 'Роль' у ассистента),
+    сдача - словарем с ключами из SUBMISSION_FIELDS.
+    """
+    flush_interval = 5.0
+
+    def __init__(self):
+        self.admins = []
+        self.lessons = []
+
+    def load(self):
+        raise NotImplementedError
+
+    @property
+    def lessons_passed(self) -> int:
+        return len(self.lessons)
+
+    def student_ids(self) -> list[int]:
+        raise NotImplementedError
+
+    def student(self, student_id: int) -> dict:
+        raise NotImplementedError
+
+    def find_student(self, username: str):
+        raise NotImplementedError
+
+    def find_admin(self, username: str):
+        for admin in self.admins:
+            if admin['Ник'] == username:
+                return admin
+        return None
+
+    def assistants(self) -> list[str]:
+        return [admin['Ник'] for admin in self.admins if admin['Роль'] == 'Ассистент']
+
+    def submission(self, student_id: int, lesson: int) -> dict:
+        raise NotImplementedError
+
+    def inspector_submissions(self, lesson: int, inspector: str) -> list[tuple[int, dict]]:
+        raise NotImplementedError
+
+    def iter_submissions(self):
+        """Все сдачи по одной: (id студента, номер дз, сдача)."""
+        for lesson in range(1, self.lessons_passed + 1):
+            for student_id in self.student_ids():
+                yield student_id, lesson, self.submission(student_id, lesson)
+
+    def lesson_submissions(self, lesson: int):
+        """Сдачи одного занятия: (id студента, сдача)."""
+        for student_id in self.student_ids():
+            yield student_id, self.submission(student_id, lesson)
+
+    def add_lesson(self, lesson_date: str, inspectors: dict) -> int:
+        """Добавляет занятие, inspectors - словарь id студента -> ник проверяющего."""
+        raise NotImplementedError
+
+    def update_submission(self, student_id: int, lesson: int, **fields):
+        raise NotImplementedError
+
+    def _check_lesson(self, lesson: int):
+        if not 1 <= lesson <= self.lessons_passed:
+            raise KeyError(f'lesson {lesson} was not added yet')
+
+    def file_id(self, student_id: int, lesson: int):
+        """Телеграмный file_id сданного файла, чтобы пересылать его без загрузки с диска."""
+        raise NotImplementedError
+
+    def set_file_id(self, student_id: int, lesson: int, file_id):
+        """Запоминает file_id, None сбрасывает его (например, при пересдаче)."""
+        raise NotImplementedError
+
+    def chat_ids(self) -> dict:
+        """Ник -> id чата с ботом, известны для тех, кто хоть раз писал боту."""
+        raise NotImplementedError
+
+    def set_chat_id(self, username: str, chat_id: int):
+        raise NotImplementedError
+
+    def roster_paths(self) -> list[str]:
+        """Файлы списков, которые кураторы правят руками, пусто - правок на лету нет."""
+        return []
+
+    def written_stamp(self, path: str):
+        """file_stamp последней записи path самим ботом."""
+        return None
+
+    def reload(self, paths: list[str]) -> RosterDiff:
+        """Перечитывает измененные руками файлы из roster_paths."""
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    async def run_flusher(self, run_blocking=None):
+        """Периодически сбрасывает изменения на диск, пока задачу не отменят.
+
+        run_blocking - корутина вида run(func), выносящая запись из цикла событий.
+        """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                if run_blocking is None:
+                    self.flush()
+                else:
+                    await run_blocking(self.flush)
+            except Exception:
+                logger.exception('Failed to flush storage to disk')
+
+    def export_tables(self) -> tuple[list[str], list[dict]]:
+        """Студенты со сдачами в прежнем широком формате для кураторов."""
+        columns = list(STUDENT_COLUMNS)
+        for n, lesson_date in enumerate(self.lessons, 1):
+            columns.append(lesson_column(n, lesson_date))
+            columns.extend(lesson_column(n, f) for f in SUBMISSION_FIELDS)
+        records = []
+        for student_id in self.student_ids():
+            record = dict(self.student(student_id))
+            for n in range(1, self.lessons_passed + 1):
+                for field, value in self.submission(student_id, n).items():
+                    record[lesson_column(n, field)] = value
+            records.append(record)
+        return columns, records
+
+
+class CsvStorage(Storage):
+    """Студенты, ассистенты и сдачи дз в памяти поверх прежних csv.
+
+    Студент адресуется номером строки в students.csv, как и раньше.
+    Таблица сохраняет широкий формат: на каждое занятие пять колонок
+    day_N_<дата>, day_N_hw_path, day_N_inspector, day_N_comment, day_N_mark.
+    Изменения сбрасываются на диск по таймеру или при остановке бота.
+    file_id сданных файлов и id чатов лежат рядом в file_ids.csv и chat_ids.csv;
+    file_id привязаны к нику, так что переставленные без бота строки их не путают.
+    snapshot_path - снимок всех таблиц для быстрого старта, None - без снимка.
+    readonly - ничего не писать на диск: ни таблицы, ни снимок (для утилит,
+    которые работают рядом с запущенным ботом).
+    """
+
+    def __init__(self, students_path: str, admins_path: str, flush_interval: float = 5.0,
+                 file_ids_path: str = None, snapshot_path: str = None, readonly: bool = False):
+        super().__init__()
+        self.readonly = readonly
+        self.students_path = students_path
+        self.admins_path = admins_path
+        self.file_ids_path = file_ids_path or os.path.join(
+            os.path.dirname(os.path.abspath(students_path)), 'file_ids.csv')
+        self.chat_ids_path = os.path.join(os.path.dirname(os.path.abspath(students_path)), 'chat_ids.csv')
+        self.snapshot_path = snapshot_path
+        self.flush_interval = flush_interval
+        self.student_columns = list(STUDENT_COLUMNS)
+        self.admin_columns = list(ADMIN_COLUMNS)
+        self.students = []
+        self.file_ids = {}
+        self._chat_ids = {}
+        # имена таблиц, которые надо записать: students, admins, file_ids, chat_ids
+        self._dirty = set()
+        # (строка, колонка) -> значение: еще не записанные в students.csv правки,
+        # чтобы не потерять их, если куратор в это время поменял файл
+        self._pending = {}
+        # путь -> file_stamp после последней нашей записи или чтения
+        self._written = {}
+        # запись на диск может идти не из цикла событий, поэтому обычный lock
+        self._lock = threading.Lock()
+        # запись и перечитывание файлов целиком не пересекаются
+        self._io_lock = threading.Lock()
+
+    def _sources(self) -> list[str]:
+        return [self.students_path, self.admins_path, self.file_ids_path, self.chat_ids_path]
+
+    def load(self):
+        if not self.readonly:
+            if not os.path.exists(self.students_path):
+                atomic_write_csv(self.students_path, self.student_columns, [])
+            if not os.path.exists(self.admins_path):
+                atomic_write_csv(self.admins_path, self.admin_columns, [])
+        # метки берутся до чтения: правка во время чтения с ними не совпадет и не попадет в снимок
+        stamps = file_stamp(self._sources())
+        self._written.update((stamp[0], stamp) for stamp in stamps)
+        if self.snapshot_path is not None:
+            data = load_snapshot(self.snapshot_path, stamps)
+            if data is not None:
+                (self.student_columns, self.students, self.admin_columns, self.admins,
+                 self.lessons, self.file_ids, self._chat_ids) = data
+                return
+        self.student_columns, self.students = read_csv_records(self.students_path)
+        self.admin_columns, self.admins = read_csv_records(self.admins_path)
+        self.lessons = self._parse_lessons(self.student_columns)
+        self.file_ids = {}
+        if os.path.exists(self.file_ids_path):
+            rows = {student['Ник']: row for row, student in enumerate(self.students) if student['Ник']}
+            for record in read_csv_records(self.file_ids_path)[1]:
+                row = student_row(rows, record)
+                if row < len(self.students):
+                    self.file_ids[(row, int(record['lesson']))] = record['file_id']
+        self._chat_ids = {}
+        if os.path.exists(self.chat_ids_path):
+            for record in read_csv_records(self.chat_ids_path)[1]:
+                self._chat_ids[record['Ник']] = int(record['chat_id'])
+        self.save_snapshot()
+
+    def roster_paths(self) -> list[str]:
+        return [self.students_path, self.admins_path]
+
+    def written_stamp(self, path: str):
+        return self._written.get(path)
+
+    def _remember_stamps(self, paths: list[str]):
+        for stamp in file_stamp(paths):
+            self._written[stamp[0]] = stamp
+
+    def reload(self, paths: list[str]) -> RosterDiff:
+        """Подхватывает правки students.csv и assistants.csv, сделанные руками.
+
+        id студента - номер строки, поэтому переставлять и удалять строки нельзя
+        (такая правка отклоняется, см. rejected: бот продолжает работать со старым
+        списком и не перезаписывает файл, пока его не исправят), а дописывать в конец
+        и править ячейки можно. Несохраненные изменения бота накладываются поверх файла.
+        """
+        with self._io_lock:
+            return self._reload(paths)
+
+    def _reload(self, paths: list[str]) -> RosterDiff:
+        stamps = file_stamp(paths)
+        students = admins = None
+        if self.students_path in paths:
+            students = read_csv_records(self.students_path)
+        if self.admins_path in paths:
+            admins = read_csv_records(self.admins_path)
+        stamps = {stamp[0]: stamp for stamp in stamps}
+        diff = RosterDiff([], [], [], set(), None)
+        with self._lock:
+            if admins is not None:
+                self._written[self.admins_path] = stamps[self.admins_path]
+                removed, added = admins_diff(self.admins, admins[1])
+                diff.admins_removed.extend(removed)
+                diff.admins_added.extend(added)
+                self.admin_columns, self.admins = admins
+            if students is None:
+                return diff
+            columns, records = students
+            moved = moved_row({s['Ник']: row for row, s in enumerate(self.students) if s['Ник']}, records)
+            if moved is not None:
+                # метку не запоминаем: flush не тронет файл, пока куратор его не исправит
+                return diff._replace(rejected=moved)
+            self._written[self.students_path] = stamps[self.students_path]
+            for col in self.student_columns:
+                if col not in columns:
+                    columns.append(col)
+            for record in records:
+                for col in columns:
+                    record.setdefault(col, None)
+            for (row, col), value in self._pending.items():
+                if row < len(records):
+                    records[row][col] = value
+            for row in range(max(len(records), len(self.students))):
+                old = self.students[row] if row < len(self.students) else {}
+                new = records[row] if row < len(records) else {}
+                if any(old.get(c) != new.get(c) for c in STUDENT_COLUMNS):
+                    diff.students.append((row, old or None, new or None))
+                for col in columns:
+                    parts = col.split('_', 2)
+                    if parts[0] == 'day' and parts[1].isdigit() and old.get(col) != new.get(col):
+                        diff.lessons.add(int(parts[1]))
+            self.student_columns, self.students = columns, records
+            self.lessons = self._parse_lessons(columns)
+        return diff
+
+    def save_snapshot(self):
+        """Снимок пишется, только если в памяти то же, что и в csv.
+
+        Он помечается метками файлов, прочитанных или записанных ботом последними.
+        Если файлы с тех пор правили руками (а reload еще не успел), снимок
+        удаляется: иначе на следующем старте он выдал бы старые данные за новые.
+        """
+        if self.snapshot_path is None or self.readonly:
+            return
+        with self._io_lock, self._lock:
+            if self._dirty:
+                return
+            sources = self._sources()
+            stamp = tuple(self._written.get(path) for path in sources)
+            try:
+                if stamp != file_stamp(sources):
+                    logger.info('%s changed since last read, dropping snapshot', ', '.join(sources))
+                    drop_snapshot(self.snapshot_path)
+                    return
+                data = (self.student_columns, self.students, self.admin_columns, self.admins,
+                        self.lessons, self.file_ids, self._chat_ids)
+                save_snapshot(self.snapshot_path, stamp, data)
+            except OSError:
+                logger.exception('Failed to save snapshot %s', self.snapshot_path)
+
+    def close(self):
+        if self.readonly:
+            return
+        # правки последних секунд, которые еще не подхватил reload
+        with self._io_lock:
+            edited = [path for path in self.roster_paths() if file_stamp([path])[0] != self._written.get(path)]
+            if edited:
+                try:
+                    self._reload(edited)
+                except Exception:
+                    logger.exception('Failed to reload %s', ', '.join(edited))
+        self.flush(overwrite_edited=True)
+        self.save_snapshot()
+
+    @staticmethod
+    def _parse_lessons(columns: list[str]) -> list[str]:
+        """Восстанавливает даты занятий по колонкам day_N_<дата>."""
+        lessons = {}
+        for col in columns:
+            parts = col.split('_', 2)
+            if len(parts) != 3 or parts[0] != 'day' or not parts[1].isdigit():
+                continue
+            if parts[2] in SUBMISSION_FIELDS:
+                continue
+            lessons[int(parts[1])] = parts[2]
+        return [lessons[n] for n in sorted(lessons)]
+
+    def student_ids(self) -> list[int]:
+        return list(range(len(self.students)))
+
+    def student(self, row: int) -> dict:
+        return self.students[row]
+
+    def find_student(self, username: str):
+        for row, student in enumerate(self.students):
+            if student['Ник'] == username:
+                return row
+        return None
+
+    def submission(self, row: int, lesson: int) -> dict:
+        student = self.students[row]
+        return {field: student.get(lesson_column(lesson, field)) for field in SUBMISSION_FIELDS}
+
+    def inspector_submissions(self, lesson: int, inspector: str) -> list[tuple[int, dict]]:
+        col = lesson_column(lesson, 'inspector')
+        return [
+            (row, self.submission(row, lesson))
+            for row, student in enumerate(self.students)
+            if student.get(col) == inspector
+        ]
+
+    def add_lesson(self, lesson_date: str, inspectors: dict) -> int:
+        with self._lock:
+            self.lessons.append(lesson_date)
+            n = len(self.lessons)
+            new_columns = [lesson_column(n, lesson_date)] + [lesson_column(n, f) for f in SUBMISSION_FIELDS]
+            self.student_columns.extend(new_columns)
+            for row, student in enumerate(self.students):
+                for col in new_columns:
+                    student[col] = None
+                student[lesson_column(n, 'inspector')] = inspectors.get(row)
+                self._pending[(row, lesson_column(n, 'inspector'))] = inspectors.get(row)
+            self._dirty.add('students')
+        return n
+
+    def update_submission(self, row: int, lesson: int, **fields):
+        self._check_lesson(lesson)
+        with self._lock:
+            student = self.students[row]
+            for field, value in fields.items():
+                if field not in SUBMISSION_FIELDS:
+                    raise KeyError(field)
+                student[lesson_column(lesson, field)] = value
+                self._pending[(row, lesson_column(lesson, field))] = value
+            self._dirty.add('students')
+
+    def file_id(self, row: int, lesson: int):
+        return self.file_ids.get((row, lesson))
+
+    def set_file_id(self, row: int, lesson: int, file_id):
+        with self._lock:
+            if file_id is None:
+                self.file_ids.pop((row, lesson), None)
+            else:
+                self.file_ids[(row, lesson)] = file_id
+            self._dirty.add('file_ids')
+
+    def chat_ids(self) -> dict:
+        return dict(self._chat_ids)
+
+    def set_chat_id(self, username: str, chat_id: int):
+        with self._lock:
+            self._chat_ids[username] = chat_id
+            self._dirty.add('chat_ids')
+
+    def _table(self, name: str) -> tuple[str, list[str], list[dict]]:
+        """Копия таблицы для записи, снимается под замком."""
+        if name == 'students':
+            return self.students_path, list(self.student_columns), [dict(s) for s in self.students]
+        if name == 'admins':
+            return self.admins_path, list(self.admin_columns), [dict(a) for a in self.admins]
+        if name == 'chat_ids':
+            return self.chat_ids_path, list(CHAT_ID_COLUMNS), [
+                {'Ник': nick, 'chat_id': chat_id} for nick, chat_id in self._chat_ids.items()
+            ]
+        return self.file_ids_path, list(FILE_ID_COLUMNS), [
+            {'student': row, 'Ник': self.students[row]['Ник'], 'lesson': lesson, 'file_id': file_id}
+            for (row, lesson), file_id in self.file_ids.items()
+        ]
+
+    def flush(self, overwrite_edited: bool = False):
+        """Сбрасывает накопленные изменения на диск, если они есть.
+
+        Список, который поправили руками, не перезаписывается, пока правку
+        не подхватит reload, иначе она бы потерялась. С overwrite_edited (при
+        остановке) изменения бота все же пишутся, а так и не примененная правка
+        откладывается рядом, в <имя>.rejected.csv.
+        """
+        if self.readonly:
+            return
+        with self._io_lock:
+            with self._lock:
+                edited = {name for name, path in (('students', self.students_path), ('admins', self.admins_path))
+                          if name in self._dirty and file_stamp([path])[0] != self._written.get(path)}
+                aside = []
+                if overwrite_edited:
+                    aside = [self.students_path if name == 'students' else self.admins_path for name in edited]
+                    edited = set()
+                dirty = self._dirty - edited
+                self._dirty &= edited
+                pending = {}
+                if 'students' in dirty:
+                    pending, self._pending = self._pending, {}
+                tables = [self._table(name) for name in dirty]
+            try:
+                for path in aside:
+                    root, ext = os.path.splitext(path)
+                    shutil.copyfile(path, root + '.rejected' + ext)
+                    logger.error('Edit of %s was not applied, it is kept as %s', path, root + '.rejected' + ext)
+                for table in tables:
+                    atomic_write_csv(*table)
+                    with self._lock:
+                        self._remember_stamps([table[0]])
+            except Exception:
+                # не теряем изменения, попробуем в следующий раз
+                with self._lock:
+                    self._dirty |= dirty
+                    pending.update(self._pending)
+                    self._pending = pending
+                raise
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    nick TEXT
+);
+CREATE TABLE IF NOT EXISTS assistants (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    nick TEXT,
+    role TEXT
+);
+CREATE TABLE IF NOT EXISTS lessons (
+    num INTEGER PRIMARY KEY,
+    date TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS submissions (
+    student_id INTEGER NOT NULL REFERENCES students(id),
+    lesson INTEGER NOT NULL REFERENCES lessons(num),
+    hw_path TEXT,
+    inspector TEXT,
+    comment TEXT,
+    mark TEXT,
+    PRIMARY KEY (student_id, lesson)
+);
+CREATE INDEX IF NOT EXISTS submissions_lesson_inspector ON submissions(lesson, inspector);
+CREATE TABLE IF NOT EXISTS file_ids (
+    student_id INTEGER NOT NULL,
+    lesson INTEGER NOT NULL,
+    file_id TEXT NOT NULL,
+    PRIMARY KEY (student_id, lesson)
+);
+CREATE TABLE IF NOT EXISTS chat_ids (
+    nick TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS roster_files (
+    name TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    size INTEGER
+);
+"""
+
+
+class SqliteStorage(Storage):
+    """Нормализованное хранилище в sqlite.
+
+    Списки студентов и ассистентов небольшие и держатся в памяти,
+    сдачи лежат в таблице submissions с ключом (student_id, lesson),
+    так что сдача и оценка - это одна запись строки по индексу.
+
+    students_path и admins_path - списки, которые кураторы правят руками: правки
+    имен, ников и новые строки переносятся в базу (см. reload), остальные
+    колонки students.csv не читаются. В roster_files - метки последних перенесенных
+    версий, так что правки, сделанные пока бот стоял, переносятся при старте.
+    """
+
+    def __init__(self, db_path: str, students_path: str = None, admins_path: str = None,
+                 readonly: bool = False):
+        super().__init__()
+        self.db_path = db_path
+        self.students_path = students_path
+        self.admins_path = admins_path
+        self.readonly = readonly
+        self.students = {}
+        self._by_nick = {}
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self.readonly:
+            # mode=ro не создает базу и не меняет ее схему
+            uri = pathlib.Path(self.db_path).absolute().as_uri() + '?mode=ro'
+            self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+        self.students = {
+            student_id: {'Имя': name, 'Ник': nick}
+            for student_id, name, nick in self._conn.execute('SELECT id, name, nick FROM students ORDER BY id')
+        }
+        self._by_nick = {student['Ник']: student_id for student_id, student in self.students.items()}
+        self.admins = [
+            {'Имя': name, 'Ник': nick, 'Роль': role}
+            for name, nick, role in self._conn.execute('SELECT name, nick, role FROM assistants ORDER BY id')
+        ]
+        self.lessons = [d for d, in self._conn.execute('SELECT date FROM lessons ORDER BY num')]
+
+    def student_ids(self) -> list[int]:
+        return list(self.students)
+
+    def student(self, student_id: int) -> dict:
+        return self.students[student_id]
+
+    def find_student(self, username: str):
+        return self._by_nick.get(username)
+
+    def roster_paths(self) -> list[str]:
+        return [path for path in (self.students_path, self.admins_path) if path is not None]
+
+    def written_stamp(self, path: str):
+        with self._lock:
+            row = self._conn.execute('SELECT mtime_ns, size FROM roster_files WHERE name = ?',
+                                     (os.path.basename(path),)).fetchone()
+        return (path, *row) if row else None
+
+    def _remember_stamps(self, stamps):
+        self._conn.executemany(
+            'INSERT INTO roster_files(name, mtime_ns, size) VALUES (?, ?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET mtime_ns = excluded.mtime_ns, size = excluded.size',
+            ((os.path.basename(path), mtime_ns, size) for path, mtime_ns, size in stamps),
+        )
+
+    def reload(self, paths: list[str]) -> RosterDiff:
+        """Переносит в базу правки students.csv и assistants.csv, сделанные руками.
+
+        id студента - номер строки, как при переносе csv в базу, поэтому дописывать
+        строки в конец и править имена и ники можно, а переставлять и удалять
+        строки нельзя: такая правка отклоняется (см. rejected) и не переносится.
+        """
+        stamps = {stamp[0]: stamp for stamp in file_stamp(paths)}
+        students = admins = None
+        if self.students_path in paths:
+            students = [{col: record.get(col) for col in STUDENT_COLUMNS}
+                        for record in read_csv_records(self.students_path)[1]]
+        if self.admins_path in paths:
+            admins = [{col: record.get(col) for col in ADMIN_COLUMNS}
+                      for record in read_csv_records(self.admins_path)[1]]
+        diff = RosterDiff([], [], [], set(), None)
+        with self._lock, self._conn:
+            if admins is not None:
+                removed, added = admins_diff(self.admins, admins)
+                diff.admins_removed.extend(removed)
+                diff.admins_added.extend(added)
+                self._conn.execute('DELETE FROM assistants')
+                self._conn.executemany('INSERT INTO assistants(name, nick, role) VALUES (?, ?, ?)',
+                                       ((a['Имя'] or '', a['Ник'], a['Роль']) for a in admins))
+                self._remember_stamps([stamps[self.admins_path]])
+                self.admins = admins
+            if students is None:
+                return diff
+            rejected = moved_row({nick: sid for nick, sid in self._by_nick.items() if nick}, students)
+            if rejected is None and len(students) < len(self.students):
+                rejected = f'удалены строки начиная с {len(students) + 2}'
+            if rejected is not None:
+                return diff._replace(rejected=rejected)
+            # в базе имя не пустое, пустые ячейки приводим к тому же виду
+            for new in students:
+                new['Имя'] = new['Имя'] or ''
+            for student_id, new in enumerate(students):
+                old = self.students.get(student_id)
+                if new != old:
+                    diff.students.append((student_id, old, new))
+            self._conn.executemany(
+                'INSERT INTO students(id, name, nick) VALUES (?, ?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET name = excluded.name, nick = excluded.nick',
+                ((student_id, new['Имя'], new['Ник']) for student_id, _, new in diff.students),
+            )
+            self._remember_stamps([stamps[self.students_path]])
+            self.students = dict(enumerate(students))
+            self._by_nick = {student['Ник']: student_id for student_id, student in self.students.items()
+                             if student['Ник']}
+        return diff
+
+    def submission(self, student_id: int, lesson: int) -> dict:
+        METRICS.storage_io('read')
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT hw_path, inspector, comment, mark FROM submissions WHERE student_id = ? AND lesson = ?',
+                (student_id, lesson),
+            ).fetchone()
+        return dict(zip(SUBMISSION_FIELDS, row or (None,) * len(SUBMISSION_FIELDS)))
+
+    def inspector_submissions(self, lesson: int, inspector: str) -> list[tuple[int, dict]]:
+        METRICS.storage_io('read')
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT student_id, hw_path, inspector, comment, mark FROM submissions '
+                'WHERE lesson = ? AND inspector = ? ORDER BY student_id',
+                (lesson, inspector),
+            ).fetchall()
+        return [(row[0], dict(zip(SUBMISSION_FIELDS, row[1:]))) for row in rows]
+
+    def iter_submissions(self):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT student_id, lesson, hw_path, inspector, comment, mark FROM submissions '
+                'ORDER BY lesson, student_id'
+            ).fetchall()
+        for row in rows:
+            yield row[0], row[1], dict(zip(SUBMISSION_FIELDS, row[2:]))
+
+    def lesson_submissions(self, lesson: int):
+        METRICS.storage_io('read')
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT student_id, hw_path, inspector, comment, mark FROM submissions '
+                'WHERE lesson = ? ORDER BY student_id',
+                (lesson,),
+            ).fetchall()
+        for row in rows:
+            yield row[0], dict(zip(SUBMISSION_FIELDS, row[1:]))
+
+    def add_lesson(self, lesson_date: str, inspectors: dict) -> int:
+        with self._lock, self._conn:
+            n = len(self.lessons) + 1
+            self._conn.execute('INSERT INTO lessons(num, date) VALUES (?, ?)', (n, lesson_date))
+            self._conn.executemany(
+                # строка сдачи может уже быть (например, после ручной правки базы)
+                'INSERT INTO submissions(student_id, lesson, inspector) VALUES (?, ?, ?) '
+                'ON CONFLICT(student_id, lesson) DO UPDATE SET inspector = excluded.inspector',
+                ((student_id, n, inspectors.get(student_id)) for student_id in self.students),
+            )
+            self.lessons.append(lesson_date)
+        return n
+
+    def update_submission(self, student_id: int, lesson: int, **fields):
+        self._check_lesson(lesson)
+        for field in fields:
+            if field not in SUBMISSION_FIELDS:
+                raise KeyError(field)
+        columns = ', '.join(fields)
+        placeholders = ', '.join('?' * len(fields))
+        updates = ', '.join(f'{field} = excluded.{field}' for field in fields)
+        METRICS.storage_io('write')
+        with self._lock, self._conn:
+            self._conn.execute(
+                f'INSERT INTO submissions(student_id, lesson, {columns}) VALUES (?, ?, {placeholders}) '
+                f'ON CONFLICT(student_id, lesson) DO UPDATE SET {updates}',
+                (student_id, lesson, *fields.values()),
+            )
+
+    def file_id(self, student_id: int, lesson: int):
+        METRICS.storage_io('read')
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT file_id FROM file_ids WHERE student_id = ? AND lesson = ?', (student_id, lesson),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_file_id(self, student_id: int, lesson: int, file_id):
+        METRICS.storage_io('write')
+        with self._lock, self._conn:
+            if file_id is None:
+                self._conn.execute(
+                    'DELETE FROM file_ids WHERE student_id = ? AND lesson = ?', (student_id, lesson))
+            else:
+                self._conn.execute(
+                    'INSERT INTO file_ids(student_id, lesson, file_id) VALUES (?, ?, ?) '
+                    'ON CONFLICT(student_id, lesson) DO UPDATE SET file_id = excluded.file_id',
+                    (student_id, lesson, file_id),
+                )
+
+    def chat_ids(self) -> dict:
+        with self._lock:
+            return dict(self._conn.execute('SELECT nick, chat_id FROM chat_ids').fetchall())
+
+    def set_chat_id(self, username: str, chat_id: int):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO chat_ids(nick, chat_id) VALUES (?, ?) '
+                'ON CONFLICT(nick) DO UPDATE SET chat_id = excluded.chat_id',
+                (username, chat_id),
+            )
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def migrate_csv_to_sqlite(students_path: str, admins_path: str, db_path: str) -> SqliteStorage:
+    """Переносит прежние широкие csv в новую базу sqlite.
+
+    База собирается во временном файле и встает на место db_path, только если
+    перенос прошел целиком: иначе следующий старт принял бы пустую базу за готовую.
+    """
+    if os.path.exists(db_path):
+        existing = SqliteStorage(db_path)
+        existing.load()
+        try:
+            if existing.students:
+                raise ValueError(f'{db_path} уже содержит данные')
+        finally:
+            existing.close()
+    stamps = file_stamp([students_path, admins_path])
+    source = CsvStorage(students_path, admins_path)
+    source.load()
+    tmp_path = db_path + '.migrating'
+    _remove_database(tmp_path)
+    target = SqliteStorage(tmp_path)
+    target.load()
+    conn = target._conn
+    try:
+        with target._lock, conn:
+            # пустая ячейка имени (например, у убранного студента) в базе - пустая строка
+            conn.executemany(
+                'INSERT INTO students(id, name, nick) VALUES (?, ?, ?)',
+                ((row, s['Имя'] or '', s['Ник']) for row, s in enumerate(source.students)),
+            )
+            conn.executemany(
+                'INSERT INTO assistants(name, nick, role) VALUES (?, ?, ?)',
+                ((a['Имя'] or '', a['Ник'], a['Роль']) for a in source.admins),
+            )
+            conn.executemany(
+                'INSERT INTO lessons(num, date) VALUES (?, ?)',
+                enumerate(source.lessons, 1),
+            )
+            conn.executemany(
+                'INSERT INTO submissions(student_id, lesson, hw_path, inspector, comment, mark) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    (row, n, *source.submission(row, n).values())
+                    for row in source.student_ids()
+                    for n in range(1, source.lessons_passed + 1)
+                ),
+            )
+            conn.executemany(
+                'INSERT INTO file_ids(student_id, lesson, file_id) VALUES (?, ?, ?)',
+                ((row, lesson, file_id) for (row, lesson), file_id in source.file_ids.items()),
+            )
+            conn.executemany('INSERT INTO chat_ids(nick, chat_id) VALUES (?, ?)', source.chat_ids().items())
+            target._remember_stamps(stamps)
+        target.close()
+        _remove_database(db_path)
+        os.replace(tmp_path, db_path)
+    except BaseException:
+        target.close()
+        _remove_database(tmp_path)
+        raise
+    result = SqliteStorage(db_path, students_path, admins_path)
+    result.load()
+    return result
+
+
+def _remove_database(path: str):
+    """Удаляет файл базы вместе с журналом WAL, если они есть."""
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.unlink(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def export_csv(storage: Storage, students_path: str, admins_path: str):
+    """Выгружает хранилище в csv прежнего формата, удобного кураторам."""
+    atomic_write_csv(students_path, *storage.export_tables())
+    atomic_write_csv(admins_path, list(ADMIN_COLUMNS), storage.admins)
+
+
+DEFAULT_COURSE = 'default'
+# настройки с путями, которые считаются от папки курса
+COURSE_PATHS = ('database', 'snapshot')
+
+
+def course_settings(config: dict) -> dict[str, tuple[str, dict]]:
+    """Название курса -> (папка, настройки курса) по разделу courses в config.yaml.
+
+    Настройки курса - общие настройки, поверх которых наложены его собственные,
+    пути в них считаются от папки курса. Без раздела courses курс один, в текущей папке.
+    """
+    common = {key: value for key, value in config.items() if key != 'courses'}
+    courses = config.get('courses')
+    if not courses:
+        return {DEFAULT_COURSE: ('.', common)}
+    result = {}
+    for name, entry in courses.items():
+        if isinstance(entry, str):
+            entry = {'dir': entry}
+        root = entry.get('dir', name)
+        settings = {**common, **{key: value for key, value in entry.items() if key != 'dir'}}
+        settings.setdefault('database', 'course.db')
+        for key in COURSE_PATHS:
+            if isinstance(settings.get(key), str):
+                settings[key] = os.path.normpath(os.path.join(root, settings[key]))
+        result[str(name)] = (root, settings)
+    return result
+
+
+def course_files(root: str) -> tuple[str, str]:
+    """students.csv и assistants.csv в папке курса."""
+    return (os.path.normpath(os.path.join(root, 'students.csv')),
+            os.path.normpath(os.path.join(root, 'assistants.csv')))
+
+
+def add_course_arguments(parser: argparse.ArgumentParser):
+    """Аргументы --config и --course утилит командной строки (см. cli_courses)."""
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--course', help='название курса из раздела courses, по умолчанию все')
+
+
+def cli_courses(args) -> dict[str, tuple[str, dict]]:
+    """course_settings из файла --config, только курс --course, если он задан."""
+    with open(args.config) as file:
+        config = yaml.safe_load(file)
+    courses = course_settings(config)
+    if args.course is None:
+        return courses
+    if args.course not in courses:
+        raise SystemExit(f'В {args.config} нет курса {args.course}')
+    return {args.course: courses[args.course]}
+
+
+def readonly_storages(courses: dict):
+    """(название, папка, настройки, хранилище) каждого курса для утилит командной строки."""
+    for name, (root, settings) in courses.items():
+        # бот может работать в это же время, поэтому хранилище только читается
+        yield name, root, settings, open_storage(settings, *course_files(root), readonly=True)
+
+
+def open_storage(config: dict, students_path: str, admins_path: str, readonly: bool = False) -> Storage:
+    """Создает хранилище по настройке storage из config.yaml (csv или sqlite).
+
+    readonly - для утилит рядом с запущенным ботом: хранилище только читает
+    с диска, ничего не переносит и не пишет ни при изменениях, ни при close.
+    """
+    kind = config.get('storage', 'csv')
+    if kind == 'csv':
+        snapshot = config.get('snapshot', os.path.join(os.path.dirname(os.path.abspath(students_path)),
+                                                       'course.snapshot'))
+        storage = CsvStorage(students_path, admins_path,
+                             flush_interval=config.get('flush_interval', 5.0),
+                             snapshot_path=snapshot or None, readonly=readonly)
+        storage.load()
+    elif kind == 'sqlite':
+        db_path = config.get('database', 'course.db')
+        if readonly:
+            if not os.path.exists(db_path) and os.path.exists(students_path):
+                # бот еще не переносил csv в базу, данные пока в csv
+                storage = CsvStorage(students_path, admins_path, readonly=True)
+            else:
+                storage = SqliteStorage(db_path, readonly=True)
+            storage.load()
+        elif not os.path.exists(db_path) and os.path.exists(students_path):
+            logger.info('Migrating %s and %s into %s', students_path, admins_path, db_path)
+            storage = migrate_csv_to_sqlite(students_path, admins_path, db_path)
+        else:
+            storage = SqliteStorage(db_path, students_path, admins_path)
+            storage.load()
+    else:
+        raise ValueError(f'Unknown storage backend: {kind}')
+    return storage
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Перенос данных курса между csv и sqlite')
+    commands = parser.add_subparsers(dest='command', required=True)
+    migrate = commands.add_parser('migrate', help='перенести csv в sqlite')
+    migrate.add_argument('students')
+    migrate.add_argument('admins')
+    migrate.add_argument('database')
+    export = commands.add_parser('export', help='выгрузить sqlite в csv')
+    export.add_argument('database')
+    export.add_argument('students')
+    export.add_argument('admins')
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        migrate_csv_to_sqlite(args.students, args.admins, args.database).close()
+    else:
+        storage = SqliteStorage(args.database)
+        storage.load()
+        export_csv(storage, args.students, args.admins)
+        storage.close()
+
+
+if __name__ == '__main__':
+    main()
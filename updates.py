@@ -0,0 +1,71 @@
+"""Параллельная обработка обновлений с сохранением порядка для каждого пользователя."""
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from locks import KeyedLock
+
+# ограничение базового класса, которое никогда не достигается
+UNLIMITED = 2 ** 30
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Обновления разных пользователей обрабатываются одновременно,
+    а обновления одного пользователя - строго по очереди.
+
+    ConversationHandler хранит состояние диалога по (чат, пользователь),
+    поэтому два сообщения одного студента (файл и сразу за ним комментарий)
+    не должны обгонять друг друга. Все остальное защищают блокировки сдач.
+
+    Семафор базового класса берется до do_process_update, то есть до замка
+    пользователя, и очередь сообщений одного пользователя занимала бы все места.
+    Поэтому базовый класс не ограничивает, а место берется уже под замком.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        if max_concurrent_updates < 1:
+            raise ValueError('`max_concurrent_updates` must be a positive integer!')
+        super().__init__(UNLIMITED)
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks = KeyedLock()
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @staticmethod
+    def _key(update: object):
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return 'user', update.effective_user.id
+            if update.effective_chat is not None:
+                return 'chat', update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine):
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            key = self._key(update)
+            if key is None:
+                async with self._slots:
+                    await coroutine
+            else:
+                async with self._locks(key), self._slots:
+                    await coroutine
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        """Дожидается обработчиков, которые еще работают."""
+        await self._idle.wait()